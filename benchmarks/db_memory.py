@@ -0,0 +1,53 @@
+# Compares the memory used by the in-memory database with the old nested dicts and with DbEntry.
+#
+# Run from the repository root:
+#   python -m benchmarks.db_memory [--rows 100000]
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local.store import parse_row
+
+
+def rows(count):
+    # Typical entries: a few real ids, the rest skipped or failed, most counters at zero.
+    for i in range(count):
+        yield json.dumps({
+            "skeet": f"bafyreib{i:051d}",
+            "ids": {"twitter_id": "skipped", "mastodon_id": f"1137{i:014d}", "discord_id": "posted",
+                    "tumblr_id": f"7{i:011d}", "bsky_id": "", "telegram_id": "FailedToPost"},
+            "failed": {"twitter": 0, "mastodon": 0, "discord": 0, "tumblr": 1, "bsky": 0, "telegram": 5}
+        })
+
+
+def legacy_row(line):
+    json_line = json.loads(line)
+    return json_line["skeet"], {"ids": json_line["ids"], "failed": json_line["failed"]}
+
+
+def measure(parse, lines):
+    tracemalloc.start()
+    database = {}
+    for line in lines:
+        skeet, entry = parse(line)
+        database[skeet] = entry
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    lines = list(rows(args.rows))
+    legacy = measure(legacy_row, lines)
+    compact = measure(parse_row, lines)
+    print(f"{'':>8} {'total MB':>10} {'bytes/entry':>12}")
+    print(f"{'dicts':>8} {legacy / 1e6:>10.1f} {legacy / args.rows:>12.0f}")
+    print(f"{'DbEntry':>8} {compact / 1e6:>10.1f} {compact / args.rows:>12.0f}")
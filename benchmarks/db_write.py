@@ -0,0 +1,55 @@
+# Measures how long a single database write (duplicate check + append) takes as the database grows.
+# With the digest index the time per write should stay flat from 1k to 1M rows.
+#
+# Run from the repository root:
+#   python -m benchmarks.db_write [--backend jsonl|sqlite] [--sizes 1000,10000,100000,1000000]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings import settings
+from local.store import JsonlStore, SqliteStore, serialize_row, make_entry
+
+settings.log_level = "none"
+
+
+def fill(path, rows):
+    with open(path, 'w') as file:
+        for i in range(rows):
+            entry = make_entry({"twitter_id": str(i), "mastodon_id": str(i)}, {})
+            file.write(serialize_row(f"bafyrei{i:020d}", entry) + "\n")
+
+
+def measure(backend, rows, writes):
+    with tempfile.TemporaryDirectory() as directory:
+        jsonl = os.path.join(directory, "database.json")
+        fill(jsonl, rows)
+        if backend == "sqlite":
+            store = SqliteStore(os.path.join(directory, "database.sqlite"), import_path=jsonl)
+        else:
+            store = JsonlStore(jsonl)
+        store.load()
+        start = time.perf_counter()
+        for i in range(writes):
+            entry = make_entry({"twitter_id": f"new{i}"}, {})
+            store.upsert(f"new{i:020d}", entry)
+            # Writing the same row again must be detected as a duplicate.
+            store.upsert(f"new{i:020d}", entry)
+        elapsed = time.perf_counter() - start
+    return elapsed / (writes * 2) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["jsonl", "sqlite"], default="jsonl")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'us/write':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"{size:>10} {measure(args.backend, size, args.writes):>10.1f}")
@@ -0,0 +1,67 @@
+# Measures how long a write_log call takes for the caller, compared to writing the line directly like
+# write_log used to (check the file, open it, write, close and print for every message).
+#
+# Run from the repository root:
+#   python -m benchmarks.log_write [--messages 20000]
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import arrow
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings import settings
+from local import logger
+from local.functions import write_log
+
+
+def write_log_direct(directory, message, type="message"):
+    tz = getattr(settings, 'TIMEZONE', 'US/Pacific')
+    now = arrow.now(tz).format("MM/DD/YYYY HH:mm:ss")
+    date = arrow.now(tz).format("YYMMDD")
+    message = str(now) + " (" + type.upper() + "): " + str(message) + "\n"
+    print(message)
+    log = directory + date + ".log"
+    append_write = 'a' if os.path.exists(log) else 'w'
+    dst = open(log, append_write)
+    dst.write(message)
+    dst.close()
+
+
+def measure(messages):
+    settings.log_level = "verbose"
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        directory += os.sep
+        with contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            for i in range(messages):
+                write_log_direct(directory, f"Posted {i} to Mastodon")
+            results["direct"] = time.perf_counter() - start
+
+            logger._writer = logger.LogWriter(directory)
+            start = time.perf_counter()
+            for i in range(messages):
+                write_log(f"Posted {i} to Mastodon")
+            results["write_log"] = time.perf_counter() - start
+            # Time until everything is on disk, for comparison
+            logger._writer.close()
+            results["write_log + flush"] = time.perf_counter() - start
+        # The lines written directly are read back too, as a plain log of the same day
+        records, _ = logger.read_logs(directory=directory)
+        assert len(records) == messages * 2
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'':>18} {'us/message':>10}")
+    for name, elapsed in measure(args.messages).items():
+        print(f"{name:>18} {elapsed / args.messages * 1e6:>10.2f}")
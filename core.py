@@ -2,9 +2,10 @@ from settings.auth import *
 from settings.paths import *
 from settings import settings
 from local.functions import write_log, cleanup, post_cache_read, post_cache_write, get_post_time_limit
-from input.bluesky import get_posts as get_bluesky_posts, get_posts
+from input.bluesky import get_posts as get_bluesky_posts, get_posts, commit_watermark, get_stream_posts
+from input.jetstream import get_stream
 from input.instagram import get_instagram_posts
-from output.post import post_to_bluesky, post
+from output.post import post_to_bluesky, post, retry_jobs
 import arrow
 from database import DatabaseManager
 from settings_manager import SettingsManager
@@ -19,6 +20,8 @@ class Crossposter:
         self.post_cache = post_cache_read()
         self.timelimit = get_post_time_limit(self.post_cache)
         self.database = self.db.read() # Load DB into memory
+        # When the author feed was last polled while the event stream was connected
+        self.stream_polled_at = None
 
     def _apply_settings(self, p: Post) -> Post:
         """Enforces global settings on a post object."""
@@ -39,6 +42,23 @@ class Crossposter:
         
         return p
 
+    def _sync_settings(self):
+        # Sync runtime settings
+        settings.TEST_MODE = self.settings_manager.get_bool("TEST_MODE", False)
+        settings.post_time_limit = self.settings_manager.get_int("POST_TIME_LIMIT", 12)
+        settings.max_retries = self.settings_manager.get_int("MAX_RETRIES", 5)
+        
+        # Sync crossposting toggles
+        settings.Twitter = self.settings_manager.get_bool("TWITTER_CROSSPOSTING", False)
+        settings.Mastodon = self.settings_manager.get_bool("MASTODON_CROSSPOSTING", False)
+        settings.Discord = self.settings_manager.get_bool("DISCORD_CROSSPOSTING", False)
+        settings.Tumblr = self.settings_manager.get_bool("TUMBLR_CROSSPOSTING", False)
+        settings.Instagram = self.settings_manager.get_bool("INSTAGRAM_CROSSPOSTING", False)
+        settings.Telegram = self.settings_manager.get_bool("TELEGRAM_CROSSPOSTING", False)
+
+        # Recalculate timelimit with updated settings
+        self.timelimit = get_post_time_limit(self.post_cache)
+
     def run(self):
         """Main execution flow."""
         if not self.lock.acquire(blocking=False):
@@ -46,35 +66,30 @@ class Crossposter:
             return
 
         try:
-            # Sync runtime settings
-            settings.TEST_MODE = self.settings_manager.get_bool("TEST_MODE", False)
-            settings.post_time_limit = self.settings_manager.get_int("POST_TIME_LIMIT", 12)
-            settings.max_retries = self.settings_manager.get_int("MAX_RETRIES", 5)
-            
-            # Sync crossposting toggles
-            settings.Twitter = self.settings_manager.get_bool("TWITTER_CROSSPOSTING", False)
-            settings.Mastodon = self.settings_manager.get_bool("MASTODON_CROSSPOSTING", False)
-            settings.Discord = self.settings_manager.get_bool("DISCORD_CROSSPOSTING", False)
-            settings.Tumblr = self.settings_manager.get_bool("TUMBLR_CROSSPOSTING", False)
-            settings.Instagram = self.settings_manager.get_bool("INSTAGRAM_CROSSPOSTING", False)
-            settings.Telegram = self.settings_manager.get_bool("TELEGRAM_CROSSPOSTING", False)
-
-            # Recalculate timelimit with updated settings
-            self.timelimit = get_post_time_limit(self.post_cache)
+            self._sync_settings()
 
             if settings.TEST_MODE:
                  write_log("[DRY RUN] Test Mode Enabled. No API calls will be made.")
 
-            # Ensure we have the latest database state from disk before starting
-            self.database = self.db.read()
-            
-            self.process_instagram()
-            self.process_bluesky()
-            
-            post_cache_write(self.post_cache)
-            
+            # The whole run is written to the database as a single transaction
+            with self.db.transaction():
+                # Ensure we have the latest database state from disk before starting
+                self.database = self.db.read()
+
+                self.process_instagram()
+                self.process_bluesky()
+                if not settings.TEST_MODE:
+                    self.process_jobs()
+
+                post_cache_write(self.post_cache)
+
+                if not settings.TEST_MODE:
+                    self.db.save(self.database)
+
             if not settings.TEST_MODE:
-                self.db.save(self.database)
+                # Only now that the run is committed are its posts skipped by the next fetch
+                commit_watermark(self.database)
+                self.db.archive()
                 self.db.backup()
             
             cleanup()
@@ -84,6 +99,28 @@ class Crossposter:
         finally:
             self.lock.release()
 
+    def retry_jobs(self):
+        """Retries the queued crossposts that are due, unless a run is already going (it retries them too)."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            settings.TEST_MODE = self.settings_manager.get_bool("TEST_MODE", False)
+            settings.max_retries = self.settings_manager.get_int("MAX_RETRIES", 5)
+            if settings.TEST_MODE:
+                return
+            with self.db.transaction():
+                self.database = self.db.read()
+                self.post_cache = post_cache_read()
+                self.process_jobs()
+                post_cache_write(self.post_cache)
+        finally:
+            self.lock.release()
+
+    def process_jobs(self):
+        updates, self.database, self.post_cache = retry_jobs(self.database, self.post_cache)
+        if updates:
+            self.db.save(self.database)
+
     def process_instagram(self):
         self.instagram_posts = {}
         # Check global Instagram toggle
@@ -119,7 +156,33 @@ class Crossposter:
         else:
             write_log("Instagram crossposting is disabled.")
 
+    def process_stream(self, refs):
+        """Crossposts the posts that arrived through the Bluesky event stream (see input.jetstream).
+        Returns the refs that couldn't be looked up yet."""
+        with self.lock:
+            self.post_cache = post_cache_read()
+            self._sync_settings()
+            with self.db.transaction():
+                self.database = self.db.read()
+                self.bluesky_posts, unresolved = get_stream_posts(refs, self.timelimit)
+                for cid, p in self.bluesky_posts.items():
+                    self._apply_settings(p)
+                if self.bluesky_posts:
+                    updates, self.database, self.post_cache = post(self.bluesky_posts, self.database, self.post_cache)
+                    post_cache_write(self.post_cache)
+                    if updates and not settings.TEST_MODE:
+                        self.db.save(self.database)
+        return unresolved
+
     def process_bluesky(self):
+        if get_stream().connected:
+            # New posts arrive through the event stream, the feed is only polled now and then to pick
+            # up what the stream missed
+            now = arrow.utcnow()
+            if self.stream_polled_at and self.stream_polled_at > now.shift(minutes=-settings.bsky_stream_poll):
+                self.bluesky_posts = {}
+                return
+            self.stream_polled_at = now
         self.bluesky_posts = get_posts(self.timelimit)
         
         # Apply settings to all
@@ -1,47 +1,28 @@
-import json
 import os
-import shutil
+import time
 import arrow
-from settings.paths import database_path, backup_path
+from settings.paths import database_path, backup_path, sqlite_path
+from settings import settings
 from local.functions import write_log
+from models.entry import DbEntry
+from local.store import get_store, convert_ids
+from local.backup import BackupManager
 
 class DatabaseManager:
-    def __init__(self, db_path=database_path, backup_path_val=backup_path):
+    def __init__(self, db_path=database_path, backup_path_val=backup_path, sqlite_path_val=sqlite_path, backend=None):
         self.db_path = db_path
         self.backup_path = backup_path_val
+        self.store = get_store(db_path, sqlite_path_val, backend)
+        self._archived_at = None
 
     def read(self):
-        """Reads the database file and returns a dictionary."""
-        database = {}
-        if not os.path.exists(self.db_path):
-            return database
-
-        with open(self.db_path, 'r') as file:
-            for line in file:
-                try:
-                    json_line = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                
-                if "skeet" not in json_line:
-                    continue
-
-                skeet = json_line["skeet"]
-                ids = self._convert_ids(json_line.get("ids", {}))
-                
-                # Default failure counts
-                failed = {"twitter": 0, "mastodon": 0, "discord": 0, "tumblr": 0, "bsky": 0}
-                if "failed" in json_line:
-                    failed.update(json_line["failed"])
-
-                database[skeet] = {
-                    "ids": ids,
-                    "failed": failed
-                }
-        return database
+        """Reads the database and returns a dictionary, or a lazily loaded view of it (db_lazy_load)."""
+        if settings.db_lazy_load:
+            return self.store.load_lazy()
+        return self.store.load()
 
     def write(self, skeet, tweet, toot, discord, tumblr, bsky, failed, database):
-        """Adds a new entry to the database and appends it to the file."""
+        """Adds a new entry to the database and writes it to the store."""
         ids = {
             "twitter_id": tweet,
             "mastodon_id": toot,
@@ -49,97 +30,44 @@ class DatabaseManager:
             "tumblr_id": tumblr,
             "bsky_id": bsky
         }
-        data = {
-            "ids": ids,
-            "failed": failed
-        }
-        
+        created_at = getattr(database.get(skeet), "created_at", 0) or int(time.time())
+        data = DbEntry(ids, failed, created_at)
+
         # Update in-memory dict
         database[skeet] = data
-        
-        # Prepare row for append
-        row = {
-            "skeet": skeet,
-            "ids": ids,
-            "failed": failed
-        }
-        json_string = json.dumps(row)
-        
-        # Check if already exists to avoid duplicates (naive check)
-        if not self._is_in_db(json_string):
-            write_log("Adding to database: " + json_string)
-            mode = 'a' if os.path.exists(self.db_path) else 'w'
-            with open(self.db_path, mode) as file:
-                file.write(json_string + "\n")
-        
+        self.store.upsert(skeet, data)
         return database
 
     def save(self, database):
-        """Completely overwrites the database file with the current in-memory state."""
-        write_log("Saving new database")
-        with open(self.db_path, 'w') as file:
-            for skeet, data in database.items():
-                row = {
-                    "skeet": skeet,
-                    "ids": data["ids"],
-                    "failed": data["failed"]
-                }
-                file.write(json.dumps(row) + "\n")
+        """Brings the stored database in line with the in-memory state."""
+        self.store.save(database)
 
-    def backup(self):
-        """Creates a backup of the database."""
-        backup_dir = os.path.dirname(self.backup_path)
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-
-        # Check if backup is needed (older than 24h)
-        if os.path.isfile(self.backup_path):
-            last_modified = arrow.Arrow.fromtimestamp(os.stat(self.backup_path).st_mtime)
-            if last_modified > arrow.utcnow().shift(hours=-24):
-                return
+    def transaction(self):
+        """Context manager grouping all writes made inside it (one per Crossposter.run)."""
+        return self.store.transaction()
 
-        if not os.path.isfile(self.db_path):
-            return
+    def archive(self):
+        """Moves entries older than db_retention_days to the archive, at most once every 24 hours."""
+        if settings.db_retention_days <= 0:
+            return 0
+        now = arrow.utcnow()
+        if self._archived_at and self._archived_at > now.shift(hours=-24):
+            return 0
+        self._archived_at = now
+        # Never archive posts that are still inside the fetch window, they are looked up on every run.
+        hours = max(settings.db_retention_days * 24, settings.post_time_limit)
+        moved = self.store.archive_older_than(now.shift(hours=-hours).int_timestamp)
+        if moved:
+            write_log(f"Moved {moved} database entries older than {settings.db_retention_days} days to the archive")
+        return moved
 
-        # Smart backup: if live DB shrank, save old backup before overwriting
-        if os.path.isfile(self.backup_path):
-            if self._count_lines(self.backup_path) < self._count_lines(self.db_path):
-                os.remove(self.backup_path)
-            else:
-                # Live DB is smaller? Suspicious. Archive the current backup.
-                date = arrow.utcnow().format("YYMMDD")
-                os.rename(self.backup_path, f"{self.backup_path}_{date}")
-                write_log("Current backup file contains more entries than live database, archived old backup.", "error")
-        
-        shutil.copyfile(self.db_path, self.backup_path)
-        write_log("Backup of database taken")
+    def backup(self):
+        """Takes a compressed full or delta snapshot of the database, at most once every 24 hours."""
+        BackupManager(self.store, os.path.dirname(self.backup_path)).backup()
 
     def _convert_ids(self, ids_in):
         """Converts legacy camelCase keys to snake_case."""
-        ids_out = {}
-        ids_out["twitter_id"] = ids_in.get("twitter_id") or ids_in.get("twitterId", "")
-        ids_out["mastodon_id"] = ids_in.get("mastodon_id") or ids_in.get("mastodonId", "")
-        ids_out["discord_id"] = ids_in.get("discord_id") or ids_in.get("discordId", "")
-        ids_out["tumblr_id"] = ids_in.get("tumblr_id") or ids_in.get("tumblrId", "")
-        ids_out["bsky_id"] = ids_in.get("bsky_id", "")
-        ids_out["telegram_id"] = ids_in.get("telegram_id") or ids_in.get("telegramId", "")
-        return ids_out
+        return convert_ids(ids_in)
 
     def _is_in_db(self, line):
-        if not os.path.exists(self.db_path):
-            return False
-        with open(self.db_path, 'r') as file:
-            # Note: This reads the whole file into memory. 
-            # For very large files, this might need optimization, 
-            # but fits the current scale.
-            return line in file.read()
-
-    def _count_lines(self, filepath):
-        count = 0
-        try:
-            with open(filepath, 'r') as f:
-                for _ in f:
-                    count += 1
-        except FileNotFoundError:
-            return 0
-        return count
+        return self.store.contains_row(line)
@@ -4,19 +4,20 @@ from settings.paths import *
 from settings import settings
 from local.functions import write_log, lang_toggle
 import arrow
+import json
 import os
-import subprocess
-import random
-import string
-from settings.paths import image_path
-import time
+import threading
 from typing import Any, Dict
 from models.post import Post, Media
+from local.ttl_cache import TtlCache, MISSING
+from atproto import models
 
 # Date format adjustment
 date_in_format = 'YYYY-MM-DDTHH:mm:ssZ'
 
 _bsky_client: Client | None = None
+# Posts are sent to Bluesky from several threads at once, only one of them should log in.
+_bsky_lock = threading.Lock()
 
 
 def load_session_string():
@@ -42,6 +43,11 @@ def _on_session_changed(new_session_string: str):
 
 def get_bsky_session() -> Client:
     """Return the initialized and authenticated Bluesky client (lazy)."""
+    with _bsky_lock:
+        return _get_bsky_session()
+
+
+def _get_bsky_session() -> Client:
     global _bsky_client
     if _bsky_client is not None and getattr(_bsky_client, "_session", None) is not None:
         return _bsky_client
@@ -67,6 +73,99 @@ def get_bsky_session() -> Client:
     _bsky_client = client
     return _bsky_client
 
+# Handles mentioned in crossposted text are resolved to DIDs through this cache. Handles that don't
+# exist are remembered too (as None), for a shorter time, so a typo isn't looked up in every post.
+PROFILES_BATCH = 25
+_handle_cache = None
+
+
+def _get_handle_cache():
+    global _handle_cache
+    if _handle_cache is None:
+        _handle_cache = TtlCache(handles_path)
+    return _handle_cache
+
+
+def resolve_handles(handles) -> Dict[str, str | None]:
+    """Returns {handle: did} for every handle, with None for handles that don't exist. Handles that
+    aren't cached are looked up together with getProfiles, 25 per request."""
+    cache = _get_handle_cache()
+    dids = {}
+    unknown = []
+    for handle in dict.fromkeys(h.lower() for h in handles):
+        did = cache.get(handle)
+        if did is MISSING:
+            unknown.append(handle)
+        else:
+            dids[handle] = did
+    if not unknown:
+        return dids
+    try:
+        client = get_bsky_session()
+    except Exception as e:
+        write_log(f"Failed to get Bluesky session to resolve mentions: {e}", "error")
+        return dids
+    for i in range(0, len(unknown), PROFILES_BATCH):
+        batch = unknown[i:i + PROFILES_BATCH]
+        try:
+            response: Any = client.app.bsky.actor.get_profiles(params={"actors": batch})
+        except Exception as e:
+            # Not cached, so the next post tries again
+            write_log(f"Failed to resolve handles {', '.join(batch)}: {e}", "warning")
+            continue
+        found = {profile.handle.lower(): profile.did for profile in response.profiles}
+        missing = [handle for handle in batch if handle not in found]
+        cache.set_many(found, settings.handle_cache_ttl * 3600)
+        cache.set_many(dict.fromkeys(missing), settings.handle_negative_ttl * 60)
+        dids.update(found)
+        dids.update(dict.fromkeys(missing))
+    return dids
+
+# Authors of the posts that fetched posts reply to, when the feed doesn't include them (their uri is
+# all that is known). Deleted posts are remembered too (as None) so they aren't looked up every run.
+POSTS_BATCH = 25
+_author_cache = None
+
+
+def _get_author_cache():
+    global _author_cache
+    if _author_cache is None:
+        _author_cache = TtlCache(post_authors_path)
+    return _author_cache
+
+
+def resolve_post_authors(uris) -> Dict[str, str | None]:
+    """Returns {uri: author handle} for every post uri, with None for posts that don't exist anymore.
+    Posts that aren't cached are looked up together with getPosts, 25 per request."""
+    cache = _get_author_cache()
+    authors = {}
+    unknown = []
+    for uri in dict.fromkeys(uris):
+        author = cache.get(uri)
+        if author is MISSING:
+            unknown.append(uri)
+        else:
+            authors[uri] = author
+    if not unknown:
+        return authors
+    try:
+        client = get_bsky_session()
+    except Exception as e:
+        write_log(f"Failed to get Bluesky session to look up replied to posts: {e}", "error")
+        return authors
+    for i in range(0, len(unknown), POSTS_BATCH):
+        batch = unknown[i:i + POSTS_BATCH]
+        try:
+            response: Any = client.app.bsky.feed.get_posts(params={"uris": batch})
+        except Exception as e:
+            write_log(f"Unable to retrieve replied to posts: {e}", "warning")
+            continue
+        found = {post.uri: post.author.handle for post in response.posts}
+        found.update({uri: None for uri in batch if uri not in found})
+        cache.set_many(found, settings.handle_cache_ttl * 3600)
+        authors.update(found)
+    return authors
+
 # Getting posts from Bluesky
 def get_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, Post]:  # Adjust `hours` to your desired time window
     write_log("Gathering posts")
@@ -76,6 +175,8 @@ def get_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, Post]:  # A
         write_log("[DRY RUN] Expanding time limit to find latest post for testing.")
         timelimit = arrow.get(2020, 1, 1)
 
+    global _feed_items
+    _feed_items = []
     posts = {}
     try:
         bsky = get_bsky_session()
@@ -95,136 +196,28 @@ def get_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, Post]:  # A
         return {}
     
     try:
-        profile_feed: Any = bsky.app.bsky.feed.get_author_feed({'actor': actor})  # type: ignore[arg-type]
+        feed = _fetch_author_feed(bsky, actor, timelimit)
     except Exception as e:
         write_log(f"Failed to fetch author feed: {e}", "error")
+        # None of the fetched posts were handled, the watermark stays where it is
+        _feed_items = []
         return {}
 
-    visibility = settings.visibility
+    # Replies whose parent isn't included in the feed are all looked up at once
+    resolve_post_authors([feed_view.post.record.reply.parent.uri for feed_view in feed
+                          if feed_view.post.record.reply and not _parent_author(feed_view)])
 
-    for feed_view in profile_feed.feed:
+    failed = set()
+    for feed_view in feed:
         try:
-            if feed_view.post.author.handle != BSKY_HANDLE:
-                continue
-
-            # Get and parse created_at date
-            created_at_str = feed_view.post.record.created_at.split(".")[0]
-            if not created_at_str.endswith('Z'):
-                created_at_str += 'Z'
-            created_at = arrow.get(created_at_str, 'YYYY-MM-DDTHH:mm:ssZ')
-
-            # Skip posts older than the timelimit
-            if created_at < timelimit:
-                continue
-
-            repost = False
-            if hasattr(feed_view.reason, "indexed_at"):
-                repost = True
-                created_at = arrow.get(feed_view.reason.indexed_at.split(".")[0], 'YYYY-MM-DDTHH:mm:ssZ')
-
-            langs = feed_view.post.record.langs
-            mastodon_post = (lang_toggle(langs, "mastodon") and settings.Mastodon)
-            twitter_post = (lang_toggle(langs, "twitter") and settings.Twitter)
-            
-            # Note: We aren't filtering hard here anymore, we let the Post object carry the intent
-            # via post_to dict, but preserving existing logic to skip processing if both are false 
-            # might be desired? Actually, with the new unified system, we should probably validly
-            # create the Post object and let the global settings manager enforce the final toggles.
-            # But adhering to existing logic:
-            if not mastodon_post and not twitter_post:
-                # If these are purely language-based toggles, we should probably keep them.
-                pass 
-            reply_to_user = BSKY_HANDLE
-            cid = feed_view.post.cid
-            
-            # Check if post is effectively a mention (starts with @user that is not us)
-            text = feed_view.post.record.text
-            created_at = arrow.get(feed_view.post.record.created_at)
-            send_mention = True
-            if feed_view.post.record.facets:
-                text = restore_urls(feed_view.post.record)
-                if settings.mentions != "ignore":
-                    text, send_mention = parse_mentioned_username(feed_view.post.record, text)
-            if not send_mention:
-                continue
-            if reply_to_user != BSKY_HANDLE:
-                continue
-            reply_to_post = ""
-            quoted_post = ""
-            quote_url = ""
-            allowed_reply = get_allowed_reply(feed_view.post)
-            
-            if feed_view.post.embed and hasattr(feed_view.post.embed, "record"):
-                try:
-                    quoted_user, quoted_post, quote_url, open_quote = get_quote_post(feed_view.post.embed.record)
-                except Exception as e:
-                    write_log(f"Post {cid} contains a quote type structure not currently supported. Skipping quote processing.", "warning")
-                    continue
-                if quoted_user != BSKY_HANDLE and (not settings.quote_posts or not open_quote):
-                    continue
-                elif quoted_user == BSKY_HANDLE:
-                    text = text.replace(quote_url, "")
-            
-            if feed_view.post.record.reply:
-                reply_to_post = feed_view.post.record.reply.parent.cid
-                try:
-                    reply_to_user = feed_view.reply.parent.author.handle
-                except:
-                    reply_to_user = get_reply_to_user(feed_view.post.record.reply.parent)
-            
-            if not reply_to_user:
-                write_log(f"Unable to find the user that post {cid} replies to or quotes - parent post may be deleted.", "warning")
-                continue
-
-            if created_at > timelimit and reply_to_user == BSKY_HANDLE:
-                image_data = ""
-                images = []
-                if feed_view.post.embed and hasattr(feed_view.post.embed, "images"):
-                    image_data = feed_view.post.embed.images
-                elif feed_view.post.embed and hasattr(feed_view.post.embed, "playlist"):
-                    m3u8_url = feed_view.post.embed.playlist
-                    output_mp4 = download_bsky_video(m3u8_url)
-                    if output_mp4:
-                        images.append(Media(filename=output_mp4, alt=feed_view.post.embed.alt, kind="video"))
-                    else:
-                        write_log(f"Failed to download or convert {m3u8_url} to mp4.", "error")
-                elif feed_view.post.embed and hasattr(feed_view.post.embed, "media") and hasattr(feed_view.post.embed.media, "images"):
-                    image_data = feed_view.post.embed.media.images
-                if feed_view.post.embed and hasattr(feed_view.post.embed, "external") and hasattr(feed_view.post.embed.external, "uri"):
-                    if feed_view.post.embed.external.uri not in text:
-                        text += '\n' + feed_view.post.embed.external.uri
-                
-                if image_data:
-                    for image in image_data:
-                        images.append(Media(url=image.fullsize, alt=image.alt, kind="image"))
-                
-                if visibility == "hybrid" and reply_to_post:
-                    visibility = "unlisted"
-                elif visibility == "hybrid":
-                    visibility = "public"
-                
-                link = f"https://bsky.app/profile/{BSKY_HANDLE}/post/{feed_view.post.uri.split('/')[-1]}"
-                
-                p = Post(
-                    id=cid,
-                    source="bluesky",
-                    text=text,
-                    created_at=created_at,
-                    link=link,
-                    reply_to_id=reply_to_post,
-                    quoted_id=quoted_post,
-                    quote_url=quote_url,
-                    media=images, # Assuming 'media' in the instruction meant 'images' from the original context
-                    visibility=visibility,
-                    allowed_reply=allowed_reply,
-                    repost=repost, # Assuming 'repost_post' in the instruction meant 'repost' from the original context
-                    post_to={"twitter": twitter_post, "mastodon": mastodon_post, "discord": settings.Discord, "tumblr": settings.Tumblr} # Reverted to original logic for post_to
-                )
-                
-                posts[cid] = p
-
+            p = make_post(feed_view, timelimit)
+            if p:
+                posts[p.id] = p
         except Exception as e:
             write_log(f"An error occurred while processing post {feed_view.post.cid}: {e}", "error")
+            failed.add(feed_view.post.cid)
+
+    _feed_items = [(indexed_at, cid, cid not in posts and cid not in failed) for indexed_at, cid, _ in _feed_items]
 
     if not posts and settings.TEST_MODE:
         write_log("[DRY RUN] Generating Mock BlueSky Post")
@@ -254,6 +247,242 @@ def get_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, Post]:  # A
 
     return posts
 
+# The author feed is read page by page from the newest post back to the watermark, the newest post that
+# was already handled in an earlier run, so each run only transfers new posts and a burst of posts longer
+# than one page isn't cut off. The watermark is only moved forward by commit_watermark, once the posts
+# of the run are in the database.
+FEED_PAGE_SIZE = 100
+# (indexed_at, cid, deliberately skipped by get_posts) of every item of the last fetched feed, newest first
+_feed_items = []
+
+
+def _sort_time(feed_view):
+    # Reposts are sorted into the feed by when they were reposted
+    if hasattr(feed_view.reason, "indexed_at"):
+        return arrow.get(feed_view.reason.indexed_at)
+    return arrow.get(feed_view.post.indexed_at)
+
+
+def _fetch_author_feed(bsky, actor, timelimit):
+    """Returns the feed items newer than the watermark and timelimit, following the cursor."""
+    watermark = None if settings.TEST_MODE else read_watermark()
+    items = []
+    cursor = None
+    while True:
+        params = {'actor': actor, 'limit': FEED_PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        page: Any = bsky.app.bsky.feed.get_author_feed(params)  # type: ignore[arg-type]
+        for feed_view in page.feed:
+            indexed_at = _sort_time(feed_view)
+            if indexed_at < timelimit:
+                break
+            if watermark and (indexed_at < watermark[0] or
+                              (indexed_at == watermark[0] and feed_view.post.cid == watermark[1])):
+                break
+            items.append(feed_view)
+            _feed_items.append((indexed_at, feed_view.post.cid, False))
+        else:
+            cursor = page.cursor
+            # In test mode only the newest post is used, one page is enough
+            if cursor and page.feed and not settings.TEST_MODE:
+                continue
+        break
+    if len(items) > FEED_PAGE_SIZE:
+        write_log(f"Fetched {len(items)} new posts from Bluesky")
+    return items
+
+
+def read_watermark():
+    """Returns (indexed_at, cid) of the newest post handled in an earlier run, or None."""
+    try:
+        with open(feed_state_path, 'r') as file:
+            state = json.load(file)
+        return arrow.get(state["indexed_at"]), state["cid"]
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        write_log(f"Ignoring unreadable feed watermark {feed_state_path}: {e}", "warning")
+        return None
+
+
+def commit_watermark(database):
+    """Moves the watermark to the newest post of the last fetch, or to just before the oldest post of
+    it that is neither in the database nor skipped by get_posts (held back by max_per_hour, or failed
+    to be processed for example), so that one is fetched again in the next run. Called once the run
+    is written to the database."""
+    global _feed_items
+    watermark = None
+    for indexed_at, cid, skipped in reversed(_feed_items):
+        if not skipped and cid not in database:
+            break
+        watermark = (indexed_at, cid)
+    _feed_items = []
+    if watermark is None:
+        return
+    tmp = feed_state_path + ".tmp"
+    with open(tmp, 'w') as file:
+        json.dump({"indexed_at": watermark[0].isoformat(), "cid": watermark[1]}, file)
+    os.replace(tmp, feed_state_path)
+
+def get_stream_posts(refs, timelimit):
+    """Turns (post uri, reposted at or None) from the event stream (see input.jetstream) into Posts,
+    looking the posts up 25 at a time. Returns the posts and the refs that couldn't be looked up (yet),
+    as a stream event can arrive before the post is indexed."""
+    posts = {}
+    try:
+        client = get_bsky_session()
+    except Exception as e:
+        write_log(f"Failed to get Bluesky session: {e}", "error")
+        return posts, list(refs)
+    uris = list(dict.fromkeys(uri for uri, _ in refs))
+    views = {}
+    for i in range(0, len(uris), POSTS_BATCH):
+        try:
+            response: Any = client.app.bsky.feed.get_posts(params={"uris": uris[i:i + POSTS_BATCH]})
+        except Exception as e:
+            write_log(f"Failed to look up streamed posts: {e}", "error")
+            continue
+        views.update({view.uri: view for view in response.posts})
+    feed = []
+    unresolved = []
+    for uri, reposted_at in refs:
+        if uri not in views:
+            unresolved.append((uri, reposted_at))
+            continue
+        reason = None
+        if reposted_at:
+            reason = models.AppBskyFeedDefs.ReasonRepost(by=views[uri].author, indexed_at=reposted_at)
+        feed.append(models.AppBskyFeedDefs.FeedViewPost(post=views[uri], reason=reason))
+    resolve_post_authors([feed_view.post.record.reply.parent.uri for feed_view in feed
+                          if feed_view.post.record.reply])
+    for feed_view in feed:
+        try:
+            p = make_post(feed_view, timelimit)
+            # A post and a repost of it in the same batch are crossposted as the post
+            if p and p.id not in posts:
+                posts[p.id] = p
+        except Exception as e:
+            write_log(f"An error occurred while processing post {feed_view.post.cid}: {e}", "error")
+    return posts, unresolved
+
+def make_post(feed_view, timelimit):
+    """Turns a feed item into a Post, or returns None if it isn't to be crossposted."""
+    visibility = settings.visibility
+    if feed_view.post.author.handle != BSKY_HANDLE:
+        return None
+
+    # Get and parse created_at date
+    created_at_str = feed_view.post.record.created_at.split(".")[0]
+    if not created_at_str.endswith('Z'):
+        created_at_str += 'Z'
+    created_at = arrow.get(created_at_str, 'YYYY-MM-DDTHH:mm:ssZ')
+
+    # Skip posts older than the timelimit
+    if created_at < timelimit:
+        return None
+
+    repost = False
+    if hasattr(feed_view.reason, "indexed_at"):
+        repost = True
+        created_at = arrow.get(feed_view.reason.indexed_at.split(".")[0], 'YYYY-MM-DDTHH:mm:ssZ')
+
+    langs = feed_view.post.record.langs
+    mastodon_post = (lang_toggle(langs, "mastodon") and settings.Mastodon)
+    twitter_post = (lang_toggle(langs, "twitter") and settings.Twitter)
+    
+    # Note: We aren't filtering hard here anymore, we let the Post object carry the intent
+    # via post_to dict, but preserving existing logic to skip processing if both are false 
+    # might be desired? Actually, with the new unified system, we should probably validly
+    # create the Post object and let the global settings manager enforce the final toggles.
+    # But adhering to existing logic:
+    if not mastodon_post and not twitter_post:
+        # If these are purely language-based toggles, we should probably keep them.
+        pass 
+    reply_to_user = BSKY_HANDLE
+    cid = feed_view.post.cid
+    
+    # Check if post is effectively a mention (starts with @user that is not us)
+    text = feed_view.post.record.text
+    created_at = arrow.get(feed_view.post.record.created_at)
+    send_mention = True
+    if feed_view.post.record.facets:
+        text = restore_urls(feed_view.post.record)
+        if settings.mentions != "ignore":
+            text, send_mention = parse_mentioned_username(feed_view.post.record, text)
+    if not send_mention:
+        return None
+    if reply_to_user != BSKY_HANDLE:
+        return None
+    reply_to_post = ""
+    quoted_post = ""
+    quote_url = ""
+    allowed_reply = get_allowed_reply(feed_view.post)
+    
+    if feed_view.post.embed and hasattr(feed_view.post.embed, "record"):
+        try:
+            quoted_user, quoted_post, quote_url, open_quote = get_quote_post(feed_view.post.embed.record)
+        except Exception as e:
+            write_log(f"Post {cid} contains a quote type structure not currently supported. Skipping quote processing.", "warning")
+            return None
+        if quoted_user != BSKY_HANDLE and (not settings.quote_posts or not open_quote):
+            return None
+        elif quoted_user == BSKY_HANDLE:
+            text = text.replace(quote_url, "")
+    
+    if feed_view.post.record.reply:
+        reply_to_post = feed_view.post.record.reply.parent.cid
+        reply_to_user = _parent_author(feed_view) or get_reply_to_user(feed_view.post.record.reply.parent)
+    
+    if not reply_to_user:
+        write_log(f"Unable to find the user that post {cid} replies to or quotes - parent post may be deleted.", "warning")
+        return None
+
+    if created_at > timelimit and reply_to_user == BSKY_HANDLE:
+        image_data = ""
+        images = []
+        if feed_view.post.embed and hasattr(feed_view.post.embed, "images"):
+            image_data = feed_view.post.embed.images
+        elif feed_view.post.embed and hasattr(feed_view.post.embed, "playlist"):
+            m3u8_url = feed_view.post.embed.playlist
+            # Converted in the background once the post is to be sent (see output.post and local.video)
+            images.append(Media(url=m3u8_url, alt=feed_view.post.embed.alt, kind="video"))
+        elif feed_view.post.embed and hasattr(feed_view.post.embed, "media") and hasattr(feed_view.post.embed.media, "images"):
+            image_data = feed_view.post.embed.media.images
+        if feed_view.post.embed and hasattr(feed_view.post.embed, "external") and hasattr(feed_view.post.embed.external, "uri"):
+            if feed_view.post.embed.external.uri not in text:
+                text += '\n' + feed_view.post.embed.external.uri
+        
+        if image_data:
+            for image in image_data:
+                images.append(Media(url=image.fullsize, alt=image.alt, kind="image"))
+        
+        if visibility == "hybrid" and reply_to_post:
+            visibility = "unlisted"
+        elif visibility == "hybrid":
+            visibility = "public"
+        
+        link = f"https://bsky.app/profile/{BSKY_HANDLE}/post/{feed_view.post.uri.split('/')[-1]}"
+        
+        p = Post(
+            id=cid,
+            source="bluesky",
+            text=text,
+            created_at=created_at,
+            link=link,
+            reply_to_id=reply_to_post,
+            quoted_id=quoted_post,
+            quote_url=quote_url,
+            media=images, # Assuming 'media' in the instruction meant 'images' from the original context
+            visibility=visibility,
+            allowed_reply=allowed_reply,
+            repost=repost, # Assuming 'repost_post' in the instruction meant 'repost' from the original context
+            post_to={"twitter": twitter_post, "mastodon": mastodon_post, "discord": settings.Discord, "tumblr": settings.Tumblr} # Reverted to original logic for post_to
+        )
+        
+        return p
+    return None
+
 def get_quote_post(post):
     try:
         if isinstance(post, dict):
@@ -284,16 +513,19 @@ def get_quote_post(post):
         write_log(f"Error in get_quote_post: {e}", "error")
         return None, None, None, False
 
-def get_reply_to_user(reply):
-    uri = reply.uri
-    username = ""
+def _parent_author(feed_view):
+    # Handle of the author of the post feed_view replies to if the feed includes it (not for deleted
+    # or blocked posts)
     try:
-        client = get_bsky_session()
-        response: Any = client.app.bsky.feed.get_post_thread(params={"uri": uri})
-        username = response.thread.post.author.handle
-    except Exception as e:
-        write_log(f"Unable to retrieve reply_to-user of post (parent post likely deleted). Error: {e}", "warning")
-    return username
+        return feed_view.reply.parent.author.handle
+    except AttributeError:
+        return None
+
+def get_reply_to_user(reply):
+    username = resolve_post_authors([reply.uri]).get(reply.uri)
+    if not username:
+        write_log(f"Unable to retrieve reply_to-user of post {reply.uri} (parent post likely deleted).", "warning")
+    return username or ""
 
 def restore_urls(record):
     text = record.text
@@ -341,23 +573,3 @@ def get_allowed_reply(post):
     if reply_restriction.record.allow[0].py_type == "app.bsky.feed.threadgate#mentionRule":
         return "Mentioned"
     return "Unknown"
-
-def download_bsky_video(m3u8_url):
-    """Download and convert an .m3u8 stream to .mp4 format."""
-    output_filename = ''.join(random.choice(string.ascii_lowercase) for i in range(10)) + ".mp4"
-    output_path = image_path + output_filename
-    try:
-        ffmpeg_command = ["ffmpeg", "-y", "-i", m3u8_url, "-c", "copy", output_path]
-        subprocess.run(ffmpeg_command, check=True)
-        if os.path.exists(output_path):
-            write_log(f"Successfully downloaded and converted {m3u8_url} to {output_path}.")
-            return output_path
-        else:
-            write_log(f"Failed to create output file {output_path}.")
-            return None
-    except subprocess.CalledProcessError as e:
-        write_log(f"Error during ffmpeg conversion: {e}", "error")
-        return None
-    except FileNotFoundError:
-        write_log("FFmpeg not found. Video processing skipped. Install ffmpeg to enable video support.", "warning")
-        return None
@@ -1,32 +1,82 @@
 import requests
+from requests.adapters import HTTPAdapter
 import arrow
-import random
-import string
-import urllib.request
 import os
 from settings.auth import INSTAGRAM_API_KEY as DEFAULT_KEY
-from settings.paths import image_path
 from local.functions import write_log
+from local.media_cache import get_media_cache
 from models.post import Post, Media
 from typing import Dict
 
 def get_images(images):
     local_images = []
-    for image in images:
-        url: str = image["url"]
-        alt: str = image["alt"]
-        type = ".mp4" if ".mp4" in url else ".jpg"
-        filename = ''.join(random.choice(string.ascii_lowercase) for i in range(10)) + type
-        filepath = image_path + filename
-        try:
-            urllib.request.urlretrieve(url, filepath)
-            image_info = Media(filename=filepath, url=url, alt=alt, kind="video" if type == ".mp4" else "image")
+    types = [".mp4" if image.get("type") == "VIDEO" or ".mp4" in image["url"] else ".jpg" for image in images]
+    filepaths = get_media_cache().fetch_all([(image["url"], type) for image, type in zip(images, types)])
+    for image, type, filepath in zip(images, types, filepaths):
+        if filepath:
+            image_info = Media(filename=filepath, url=image["url"], alt=image["alt"],
+                               kind="video" if type == ".mp4" else "image")
             local_images.append(image_info)
-        except Exception as e:
-             write_log(f"Failed to download image {url}: {e}", "error")
 
     return local_images
 
+# Carousel children are requested along with the posts (field expansion), and the pages of the feed are
+# followed back to the timelimit, so a feed full of carousels costs a request per page instead of one per
+# post. All requests share a session, so the connection to the API is reused.
+MEDIA_FIELDS = "id,caption,media_url,timestamp,media_type,permalink,children{media_url,media_type}"
+TIMEOUT = (10, 30)
+_session = None
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return _session
+
+def _get_json(url, params=None):
+    """Returns the json of a Graph API response, or None (logged) if the request failed."""
+    try:
+        response = _get_session().get(url, params=params, timeout=TIMEOUT)
+    except Exception as e:
+        write_log(f"Failed to connect to Instagram API: {e}", "error")
+        return None
+    if response.status_code != 200:
+        write_log(f"Failed to fetch Instagram posts: {response.status_code} - {response.text}", "error")
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        write_log(f"Failed to parse Instagram response as JSON. Status: {response.status_code}, Body: {response.text[:100]}", "error")
+        return None
+
+def _fetch_media(api_key, timelimit):
+    """Returns the posts newer than timelimit (and the first one older), following paging.next."""
+    from settings import settings
+    media_list = []
+    data = _get_json("https://graph.instagram.com/me/media", {"fields": MEDIA_FIELDS, "access_token": api_key})
+    while data:
+        page = data.get('data', [])
+        media_list.extend(page)
+        next_url = data.get('paging', {}).get('next')
+        # Posts are newest first, once one is older than the timelimit so are all on the following pages.
+        # In test mode only the newest post is used.
+        if not page or not next_url or settings.TEST_MODE or arrow.get(page[-1]['timestamp']) <= timelimit:
+            break
+        # The next url already contains the fields and access token
+        data = _get_json(next_url)
+    write_log(f"Fetched {len(media_list)} raw items from Instagram API.")
+    return media_list
+
+def _fetch_children(media_id, api_key):
+    # Only needed if the children weren't included in the post
+    data = _get_json(f"https://graph.instagram.com/{media_id}/children",
+                     {"fields": "media_url,media_type", "access_token": api_key})
+    if data is None:
+        write_log(f"Failed to fetch children for carousel {media_id}", "warning")
+        return []
+    return data.get('data', [])
+
 def get_instagram_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, Post]:
     write_log("Gathering Instagram posts")
     posts = {}
@@ -43,40 +93,17 @@ def get_instagram_posts(timelimit=arrow.utcnow().shift(hours=-1)) -> Dict[str, P
     # Get key dynamically (preferred) or fallback to import
     api_key = os.environ.get("INSTAGRAM_API_KEY", DEFAULT_KEY)
     
-    url = f"https://graph.instagram.com/me/media?fields=id,caption,media_url,timestamp,media_type,children&access_token={api_key}"
-    try:
-        response = requests.get(url)
-    except Exception as e:
-        write_log(f"Failed to connect to Instagram API: {e}", "error")
-        return posts
-
-    if response.status_code != 200:
-        write_log(f"Failed to fetch Instagram posts: {response.status_code} - {response.text}", "error")
-        return posts
-
-    try:
-        media_list = response.json().get('data', [])
-        write_log(f"Fetched {len(media_list)} raw items from Instagram API.")
-    except ValueError:
-        write_log(f"Failed to parse Instagram response as JSON. Status: {response.status_code}, Body: {response.text[:100]}", "error")
-        return posts
-    for media in media_list:
+    for media in _fetch_media(api_key, timelimit):
         created_at = arrow.get(media['timestamp'])
         # write_log(f"Checking IG Post {media['id']} ({created_at}) vs {timelimit}")
         if created_at > timelimit:
             images = []
             if media['media_type'] == 'CAROUSEL_ALBUM':
-                children_url = f"https://graph.instagram.com/{media['id']}/children?fields=media_url&access_token={api_key}"
-                children_response = requests.get(children_url)
-                if children_response.status_code == 200:
-                    children_data = children_response.json().get('data', [])
-                    # write_log(f"Fetched {len(children_data)} children for carousel {media['id']}")
-                    for child in children_data:
-                        images.append({"url": child.get('media_url', ''), "alt": ''})
-                else:
-                    write_log(f"Failed to fetch children for carousel {media['id']}: {children_response.status_code}", "warning")
+                children_data = media.get('children', {}).get('data') or _fetch_children(media['id'], api_key)
+                for child in children_data:
+                    images.append({"url": child.get('media_url', ''), "alt": '', "type": child.get('media_type')})
             else:
-                images.append({"url": media.get('media_url', ''), "alt": ''})
+                images.append({"url": media.get('media_url', ''), "alt": '', "type": media.get('media_type')})
 
             media_objects = get_images(images)
             
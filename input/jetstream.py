@@ -0,0 +1,165 @@
+from settings.paths import stream_state_path
+from settings import settings
+from local.functions import write_log
+from input.bluesky import get_bsky_session, read_watermark
+import arrow
+import json
+import os
+import time
+from urllib.parse import urlencode
+
+try:
+    from websockets.sync.client import connect
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    connect = None
+
+# Alternative to polling the author feed: a Jetstream subscription (a json version of the repo event
+# stream) filtered to our own account, so new posts are crossposted as soon as they are made. Jetstream
+# only sends the records themselves, the posts are then looked up with getPosts and go through the same
+# make_post as polled ones (see input.bluesky.get_stream_posts). The time of the last event that was
+# handled is kept as the cursor, so after a restart or a dropped connection the stream continues where
+# it left off. An event can arrive before its post is indexed, so posts that can't be looked up yet are
+# tried again every RETRY_DELAY seconds, and the cursor isn't saved past them until they are handled.
+# After RETRY_ATTEMPTS tries they are left to the regular run, which still polls the author feed now and
+# then while the stream is connected (bsky_stream_poll).
+
+POST = "app.bsky.feed.post"
+REPOST = "app.bsky.feed.repost"
+# Events that arrive within this many seconds of each other are crossposted together, up to BATCH_SIZE
+BATCH_WAIT = 1
+BATCH_SIZE = 50
+RETRY_DELAY = 5
+RETRY_ATTEMPTS = 24
+
+
+class JetstreamReader:
+    def __init__(self, url=None, state_path=stream_state_path):
+        self.url = url
+        self.state_path = state_path
+        self.connected = False
+
+    def run(self, handle, stop_event):
+        """Reads the stream until stop_event is set, reconnecting when the connection drops. handle is
+        called with a list of (post uri, reposted at or None) and must return once they are crossposted,
+        with the ones it couldn't look up yet. The cursor is saved after that."""
+        if connect is None:
+            write_log("bsky_stream is enabled but the websockets package is not installed.", "error")
+            return
+        delay = 1
+        while not stop_event.is_set():
+            try:
+                url = self.subscribe_url()
+                with connect(url, open_timeout=10) as websocket:
+                    write_log(f"Connected to {self.url or settings.jetstream_url}")
+                    self.connected = True
+                    delay = 1
+                    self._read(websocket, handle, stop_event)
+            except ConnectionClosed as e:
+                write_log(f"Bluesky event stream closed: {e}", "warning")
+            except Exception as e:
+                write_log(f"Bluesky event stream failed: {e}", "error")
+            finally:
+                self.connected = False
+            if stop_event.wait(delay):
+                break
+            delay = min(delay * 2, 60)
+
+    def subscribe_url(self):
+        client = get_bsky_session()
+        did = getattr(getattr(client, 'me', None), 'did', None) or client.com.atproto.server.get_session().did
+        params = [("wantedDids", did), ("wantedCollections", POST), ("wantedCollections", REPOST)]
+        cursor = self.read_cursor()
+        if cursor is None:
+            # Continue from the newest post the author feed was polled to
+            watermark = read_watermark()
+            if watermark:
+                cursor = int(watermark[0].float_timestamp * 1_000_000)
+        if cursor:
+            params.append(("cursor", cursor))
+        return (self.url or settings.jetstream_url) + "?" + urlencode(params)
+
+    def read_cursor(self):
+        try:
+            with open(self.state_path, 'r') as file:
+                return int(json.load(file)["cursor"])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            write_log(f"Ignoring unreadable stream cursor {self.state_path}: {e}", "warning")
+            return None
+
+    def save_cursor(self, cursor):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, 'w') as file:
+            json.dump({"cursor": cursor}, file)
+        os.replace(tmp, self.state_path)
+
+    def _read(self, websocket, handle, stop_event):
+        # {ref: [time_us, attempts, monotonic time of the next attempt]} of posts not looked up yet
+        pending = {}
+        cursor = saved = None
+        while not stop_event.is_set():
+            refs = []
+            try:
+                message = websocket.recv(timeout=BATCH_WAIT)
+            except TimeoutError:
+                message = None
+            # Take everything that arrives right after the first event along with it
+            while message is not None:
+                event = json.loads(message)
+                cursor = event.get("time_us", cursor)
+                ref = post_ref(event)
+                if ref and ref not in pending:
+                    pending[ref] = [cursor, 0, 0]
+                    refs.append(ref)
+                if len(refs) >= BATCH_SIZE:
+                    break
+                try:
+                    message = websocket.recv(timeout=BATCH_WAIT)
+                except TimeoutError:
+                    message = None
+            now = time.monotonic()
+            refs += [ref for ref, (_, attempts, retry_at) in pending.items() if attempts and retry_at <= now]
+            if refs:
+                unresolved = set(handle(refs) or ())
+                for ref in refs:
+                    if ref not in unresolved:
+                        del pending[ref]
+                        continue
+                    pending[ref][1] += 1
+                    pending[ref][2] = now + RETRY_DELAY
+                    if pending[ref][1] >= RETRY_ATTEMPTS:
+                        write_log(f"Couldn't look up streamed post {ref[0]}, leaving it to the next poll.", "warning")
+                        del pending[ref]
+            # Not past the oldest post that is still to be looked up
+            positions = [time_us - 1 for time_us, _, _ in pending.values() if time_us] + [cursor] * bool(cursor)
+            position = min(positions, default=None)
+            if position and position != saved:
+                self.save_cursor(position)
+                saved = position
+
+def post_ref(event):
+    """Returns (post uri, reposted at or None) for an event creating a post or repost, otherwise None."""
+    commit = event.get("commit")
+    if event.get("kind") != "commit" or not commit or commit.get("operation") != "create":
+        return None
+    if commit.get("collection") == POST:
+        return f"at://{event['did']}/{POST}/{commit['rkey']}", None
+    if commit.get("collection") == REPOST:
+        record = commit.get("record") or {}
+        subject = (record.get("subject") or {}).get("uri")
+        if subject:
+            reposted_at = arrow.get(record["createdAt"]) if record.get("createdAt") else arrow.utcnow()
+            return subject, reposted_at.to("utc").format("YYYY-MM-DDTHH:mm:ss") + "Z"
+    return None
+
+
+_stream = None
+
+
+def get_stream():
+    global _stream
+    if _stream is None:
+        _stream = JetstreamReader()
+    return _stream
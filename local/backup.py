@@ -0,0 +1,171 @@
+from settings.paths import backup_path
+from settings import settings
+from local.functions import write_log
+from local.store import get_store, parse_row, serialize_row
+import argparse
+import arrow
+import gzip
+import json
+import os
+
+# Backups of the database are gzipped json-lines snapshots in the backup folder. Once every
+# backup_full_days a full snapshot of every row is taken, and on the other days a delta snapshot with
+# only the rows that changed since the previous snapshot. manifest.json lists the snapshots in order
+# together with their row counts, so checking the live database against the last backup does not
+# require reading any backup file.
+#
+# Restoring replays the newest full snapshot and every delta after it:
+#   python -m local.backup list
+#   python -m local.backup restore [--upto SNAPSHOT] [--to FILE]
+
+
+class BackupManager:
+    def __init__(self, store=None, backup_dir=None):
+        self._store = store
+        self.backup_dir = backup_dir or os.path.dirname(backup_path)
+        self.manifest_path = os.path.join(self.backup_dir, "manifest.json")
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_store()
+        return self._store
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"snapshots": [], "checkpoint": None}
+        with open(self.manifest_path, 'r') as file:
+            return json.load(file)
+
+    def write_manifest(self, manifest):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def backup(self, force=False):
+        """Takes a snapshot if the last one is older than 24 hours (or force is set)."""
+        if not os.path.exists(self.backup_dir):
+            os.makedirs(self.backup_dir)
+        manifest = self.read_manifest()
+        snapshots = manifest["snapshots"]
+        now = arrow.utcnow()
+        if snapshots and not force and arrow.get(snapshots[-1]["created"]) > now.shift(hours=-24):
+            return None
+
+        live_count = self.store.count()
+        if not live_count:
+            return None
+
+        shrunk = bool(snapshots) and live_count < snapshots[-1]["total_rows"]
+        if shrunk:
+            write_log(
+                f"Live database has {live_count} entries, the last backup had {snapshots[-1]['total_rows']}. "
+                "Taking a full snapshot and keeping all older ones.", "error"
+            )
+
+        # Checkpoint before reading, so rows written meanwhile end up in the next delta too.
+        checkpoint = self.store.checkpoint()
+        rows = None
+        if not shrunk and self._last_full(snapshots) and \
+                arrow.get(self._last_full(snapshots)["created"]) > now.shift(days=-settings.backup_full_days):
+            rows = self.store.changes_since(manifest.get("checkpoint"))
+        kind = "delta" if rows is not None else "full"
+        if rows is None:
+            rows = self.store.rows()
+
+        filename = f"{kind}-{now.format('YYYYMMDD-HHmmss')}.jsonl.gz"
+        count = self._write_snapshot(os.path.join(self.backup_dir, filename), rows)
+        snapshots.append({
+            "file": filename,
+            "kind": kind,
+            "created": now.isoformat(),
+            "rows": count,
+            "total_rows": live_count,
+        })
+        manifest["checkpoint"] = checkpoint
+        if not shrunk:
+            self._prune(snapshots)
+        self.write_manifest(manifest)
+        write_log(f"Backup of database taken ({kind}, {count} entries)")
+        return filename
+
+    def restore_rows(self, upto=None):
+        """Replays the snapshots up to and including upto (default: the newest) into a dict."""
+        snapshots = self.read_manifest()["snapshots"]
+        if upto:
+            names = [snapshot["file"] for snapshot in snapshots]
+            if upto not in names:
+                raise ValueError(f"Unknown snapshot {upto}")
+            snapshots = snapshots[:names.index(upto) + 1]
+        start = max((i for i, snapshot in enumerate(snapshots) if snapshot["kind"] == "full"), default=None)
+        if start is None:
+            raise ValueError("No full snapshot to restore from")
+        database = {}
+        for snapshot in snapshots[start:]:
+            with gzip.open(os.path.join(self.backup_dir, snapshot["file"]), 'rt') as file:
+                for line in file:
+                    row = parse_row(line)
+                    if row:
+                        database[row[0]] = row[1]
+        return database
+
+    def _write_snapshot(self, path, rows):
+        count = 0
+        tmp = path + ".tmp"
+        with gzip.open(tmp, 'wt') as file:
+            for skeet, entry in rows:
+                file.write(serialize_row(skeet, entry) + "\n")
+                count += 1
+        os.replace(tmp, path)
+        return count
+
+    def _last_full(self, snapshots):
+        for snapshot in reversed(snapshots):
+            if snapshot["kind"] == "full":
+                return snapshot
+        return None
+
+    def _prune(self, snapshots):
+        # Keep the newest backup_keep full snapshots and the deltas taken after them.
+        fulls = [i for i, snapshot in enumerate(snapshots) if snapshot["kind"] == "full"]
+        if len(fulls) <= settings.backup_keep:
+            return
+        cut = fulls[-settings.backup_keep]
+        for snapshot in snapshots[:cut]:
+            try:
+                os.remove(os.path.join(self.backup_dir, snapshot["file"]))
+            except FileNotFoundError:
+                pass
+        del snapshots[:cut]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m local.backup", description="Database backups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the snapshots in the manifest")
+    commands.add_parser("backup", help="Take a snapshot now")
+    restore = commands.add_parser("restore", help="Restore the database from the snapshots")
+    restore.add_argument("--upto", help="Restore the state as of this snapshot instead of the newest one")
+    restore.add_argument("--to", help="Write the restored database to this json file instead of the live database")
+    args = parser.parse_args()
+
+    manager = BackupManager()
+    if args.command == "list":
+        for snapshot in manager.read_manifest()["snapshots"]:
+            print(f"{snapshot['file']}\t{snapshot['kind']}\t{snapshot['rows']} rows\t{snapshot['total_rows']} total")
+    elif args.command == "backup":
+        print(manager.backup(force=True) or "Nothing to back up.")
+    elif args.command == "restore":
+        database = manager.restore_rows(args.upto)
+        if args.to:
+            with open(args.to, 'w') as file:
+                for skeet, entry in database.items():
+                    file.write(serialize_row(skeet, entry) + "\n")
+        else:
+            manager.store.replace_all(database)
+        print(f"Restored {len(database)} entries to {args.to or 'the live database'}.")
+
+
+if __name__ == "__main__":
+    main()
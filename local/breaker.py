@@ -0,0 +1,112 @@
+from settings import settings
+from models.entry import Destination
+import threading
+import time
+
+# Circuit breakers per destination. After breaker_threshold failures in a row a destination is
+# considered down and is skipped for breaker_cooldown seconds, instead of every post in the batch waiting
+# for it to time out. Posts skipped this way keep their retries (see output.post). After the cooldown a
+# single post is let through; if it succeeds the destination is back, if not the cooldown starts over.
+
+
+class BreakerOpen(Exception):
+    def __init__(self, breaker):
+        self.breaker = breaker
+        super().__init__(
+            f"{breaker.name.capitalize()} is down, skipping it until "
+            f"{time.strftime('%H:%M:%S', time.localtime(breaker.retry_at))}"
+        )
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold=None, cooldown=None):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.last_error = ""
+        self._lock = threading.Lock()
+
+    @property
+    def retry_at(self):
+        return self.opened_at + (self.cooldown or settings.breaker_cooldown)
+
+    @property
+    def next_trial_at(self):
+        """When a call may be let through next. While the trial call is running its outcome isn't known
+        yet, so a whole cooldown from now is assumed."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                return time.time() + (self.cooldown or settings.breaker_cooldown)
+            return self.retry_at
+
+    def allow(self):
+        """Returns True if a call may be made now. Lets a single trial call through after the cooldown."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() >= self.retry_at:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def is_open(self):
+        """True while calls would be refused, without using up the trial call."""
+        with self._lock:
+            return self.state == self.HALF_OPEN or (self.state == self.OPEN and time.time() < self.retry_at)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error or "")
+            if self.state == self.HALF_OPEN or self.failures >= (self.threshold or settings.breaker_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def call(self, function, *args, succeeded=None, **kwargs):
+        """Calls function through the breaker. Raises BreakerOpen without calling it while open.
+        succeeded tells from the return value if the call worked, for functions that don't raise."""
+        if not self.allow():
+            raise BreakerOpen(self)
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self.record_failure(error)
+            raise
+        if succeeded is not None and not succeeded(result):
+            self.record_failure("call returned no result")
+        else:
+            self.record_success()
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "retry_at": self.retry_at if self.state != self.CLOSED else None,
+                "last_error": self.last_error,
+            }
+
+
+_breakers = {destination: CircuitBreaker(destination.fail_key) for destination in Destination}
+
+
+def get_breaker(destination):
+    return _breakers[Destination(destination)]
+
+
+def breaker_states():
+    return [breaker.snapshot() for breaker in _breakers.values()]
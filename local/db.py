@@ -1,6 +1,7 @@
-from settings.paths import database_path, backup_path
-from local.functions import write_log
-import json, os, shutil, arrow
+from local.store import get_store
+from models.entry import DbEntry
+from database import DatabaseManager
+import time
 
 
 # Function for writing new lines to the database
@@ -13,52 +14,36 @@ def db_write(skeet, tweet, toot, discord, tumblr, bsky, telegram, failed, databa
         "bsky_id": bsky,
         "telegram_id": telegram
     }
-    data = {
-        "ids": ids,
-        "failed": failed
-    }
+    created_at = getattr(database.get(skeet), "created_at", 0) or int(time.time())
+    data = DbEntry(ids, failed, created_at)
     database[skeet] = data
-    row = {
-        "skeet": skeet,
-        "ids": ids,
-        "failed": failed
-    }
-    json_string = json.dumps(row)
-    if os.path.exists(database_path):
-        append_write = 'a'
-    else:
-        append_write = 'w'
-    if not is_in_db(json_string):
-        write_log("Adding to database: " + json_string)
-        with open(database_path, append_write) as file:
-            file.write(json_string + "\n")
+    get_store().upsert(skeet, data)
+    return database
+
+
+
+# Function for writing a changed entry back to the database
+def db_update(database, skeet, entry):
+    database[skeet] = entry
+    get_store().upsert(skeet, entry)
     return database
 
 
 
+# Function for looking up a post in the database, falling back to the archive of old entries
+def db_lookup(database, skeet):
+    if not skeet:
+        return None
+    entry = database.get(skeet)
+    if entry is None:
+        entry = get_store().fetch_archived(skeet)
+    return entry
+
+
+
 # Function for reading database file and saving values in a dictionary
 def db_read():
-    database = {}
-    if not os.path.exists(database_path):
-        return database
-    with open(database_path, 'r') as file:
-        for line in file:
-            try:
-                json_line = json.loads(line)
-            except:
-                continue
-            skeet = json_line["skeet"]
-            ids = json_line["ids"]
-            ids = db_convert(ids)
-            failed = {"twitter": 0, "mastodon": 0, "discord": 0, "tumblr": 0}  # Adding tumblr failure count
-            if "failed" in json_line:
-                failed.update(json_line["failed"])  # Update with existing values, defaulting to 0 for missing keys
-            line_data = {
-                "ids": ids,
-                "failed": failed
-            }
-            database[skeet] = line_data
-    return database
+    return get_store().load()
 
 
 
@@ -94,35 +79,17 @@ def db_convert(ids_in):
 
 
 
-# Function for checking if a line is already in the database-file
+# Function for checking if a line is already in the database. This is a lookup in an index of
+# the stored rows, so it costs the same no matter how large the database is.
 def is_in_db(line):
-    if not os.path.exists(database_path):
-        return False
-    with open(database_path, 'r') as file:
-        content = file.read()
-        if line in content:
-            return True
-        else:
-            return False
+    return get_store().contains_row(line)
 
 
 # Since we are working with a version of the database in memory, at the end of the run
-# we completely overwrite the database on file with the one in memory.
-# This does kind of make it unnecessary to write each new post to the file while running,
-# but in case the program fails halfway through it gives us kind of a backup.
+# the stored database is brought in line with the one in memory. Every new post is also written
+# while running, so a run that fails halfway through still keeps what it has posted.
 def save_db(database):
-    write_log("Saving new database")
-    append_write = "w"
-    for skeet in database:
-        row = {
-            "skeet": skeet,
-            "ids": database[skeet]["ids"],
-            "failed": database[skeet]["failed"]
-        }
-        json_string = json.dumps(row)
-        with open(database_path, append_write) as file:
-            file.write(json_string + "\n")
-        append_write = "a"
+    get_store().save(database)
 
 
 # Every twelve hours a backup of the database is saved, in case something happens to the live database.
@@ -130,24 +97,7 @@ def save_db(database):
 # and before the live database is saved as a backup, the current backup is saved as a new file, so that
 # it can be recovered later.
 def db_backup():
-    # Ensure the backup directory exists
-    backup_dir = os.path.dirname(backup_path)
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-
-    if not os.path.isfile(database_path) or (os.path.isfile(backup_path)
-                                             and arrow.Arrow.fromtimestamp(
-                os.stat(backup_path).st_mtime) > arrow.utcnow().shift(hours=-24)):
-        return
-    if os.path.isfile(backup_path):
-        if count_lines(backup_path) < count_lines(database_path):
-            os.remove(backup_path)
-        else:
-            date = arrow.utcnow().format("YYMMDD")
-            os.rename(backup_path, backup_path + "_" + date)
-            write_log("Current backup file contains more entries than current live database, backup saved", "error")
-    shutil.copyfile(database_path, backup_path)
-    write_log("Backup of database taken")
+    DatabaseManager().backup()
 
 
 # Function for counting lines in a file
@@ -2,6 +2,7 @@ from settings.auth import *
 from settings.paths import *
 from local.functions import *
 import settings.settings as settings
+from local.logger import get_log_writer
 import  os, shutil, re, arrow
 
 # This function uses the language selection as a way to select which posts should be crossposted.
@@ -36,39 +37,18 @@ def post_length(post):
 
 
 
-# Function for writing to the log file
+# Function for writing to the log file. The writing itself happens in the background, see local.logger.
 def write_log(message, type = "message"):
     if settings.log_level == "none" or (settings.log_level == "error" and type == "message"):
         return;
-    # Use configured timezone (default US/Pacific)
-    tz = getattr(settings, 'TIMEZONE', 'US/Pacific')
-    now = arrow.now(tz).format("MM/DD/YYYY HH:mm:ss")
-    date = arrow.now(tz).format("YYMMDD")
-    message = str(now) + " (" + type.upper() + "): " + str(message) + "\n"
-    print(message)
-    log = log_path + date + ".log"
-    if os.path.exists(log):
-        append_write = 'a'
-    else:
-        append_write = 'w'
-    dst = open(log, append_write)
-    dst.write(message)
-    dst.close()
+    get_log_writer().write(type, message)
 
-# Cleaning up downloaded images
+# Cleaning up downloaded images. They are kept as a cache for later runs until the folder grows past
+# media_cache_size, then the least recently used ones are deleted.
 def cleanup():
-    write_log("Deleting local images")
-    for filename in os.listdir(image_path):
-        if (filename == ".gitignore"):
-            continue
-        file_path = os.path.join(image_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            write_log('Failed to delete %s. Reason: %s' % (file_path, e), "error")
+    from local.media_cache import get_media_cache
+    write_log("Cleaning up local images")
+    get_media_cache().evict()
 
 # Following two functions deals with the post per hour limit
 
@@ -0,0 +1,144 @@
+from settings.paths import queue_path, queue_media_path
+from settings import settings
+from local.functions import write_log
+from models.entry import Destination
+from models.post import Post
+import json
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+
+# Queue of crossposts that failed and are to be retried. A job is one post for one destination, it is
+# added when the first attempt in post() fails and retried with exponential backoff until it succeeds or
+# max_retries attempts have failed. The post is stored with the job, so retrying does not depend on the
+# post still being inside the fetch window. While a job is queued, post() leaves that destination to it.
+
+
+class Job:
+    __slots__ = ("cid", "destination", "post", "attempt", "next_attempt_at")
+
+    def __init__(self, cid, destination, post, attempt, next_attempt_at):
+        self.cid = cid
+        self.destination = Destination(destination)
+        self.post = post
+        self.attempt = attempt
+        self.next_attempt_at = next_attempt_at
+
+    def __repr__(self):
+        return f"Job({self.cid}, {self.destination.name.lower()}, attempt {self.attempt})"
+
+
+def backoff(attempt):
+    """Seconds to wait before the next attempt: doubles with each attempt up to queue_backoff_max,
+    and a random half of it is added so that jobs that failed together don't all retry together."""
+    delay = min(settings.queue_backoff_base * 2 ** max(attempt - 1, 0), settings.queue_backoff_max)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class JobQueue:
+    def __init__(self, path=queue_path, media_path=queue_media_path):
+        self.path = path
+        self.media_path = media_path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "cid TEXT NOT NULL, destination INTEGER NOT NULL, post TEXT NOT NULL, "
+            "attempt INTEGER NOT NULL, next_attempt_at REAL NOT NULL, "
+            "PRIMARY KEY (cid, destination))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_next_attempt_at ON jobs (next_attempt_at)")
+
+    def enqueue(self, post_obj, destination, attempt=1, at=None):
+        """Queues post_obj for destination after a failed first attempt, to be tried again after the
+        backoff or at the unix time at. Does nothing if already queued."""
+        with self._lock:
+            if self._conn.execute(
+                "SELECT 1 FROM jobs WHERE cid = ? AND destination = ?", (post_obj.id, int(destination))
+            ).fetchone():
+                return
+            data = self._keep_media(post_obj)
+            self._conn.execute(
+                "INSERT INTO jobs (cid, destination, post, attempt, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                (post_obj.id, int(destination), json.dumps(data), attempt, at or time.time() + backoff(attempt))
+            )
+        write_log(f"Queued post {post_obj.id} for another attempt at {destination.name.lower()}", "warning")
+
+    def queued(self, cid):
+        """Returns the destinations post cid has queued jobs for."""
+        with self._lock:
+            rows = self._conn.execute("SELECT destination FROM jobs WHERE cid = ?", (cid,)).fetchall()
+        return {Destination(row[0]) for row in rows}
+
+    def due(self, now=None):
+        """Returns the jobs whose next attempt is due, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cid, destination, post, attempt, next_attempt_at FROM jobs "
+                "WHERE next_attempt_at <= ? ORDER BY next_attempt_at", (now or time.time(),)
+            ).fetchall()
+        return [Job(cid, destination, Post.from_dict(json.loads(data)), attempt, next_at)
+                for cid, destination, data, attempt, next_at in rows]
+
+    def next_due(self):
+        """Returns the unix time the next job is due, or None if the queue is empty."""
+        with self._lock:
+            return self._conn.execute("SELECT MIN(next_attempt_at) FROM jobs").fetchone()[0]
+
+    def retry_later(self, job, at=None):
+        """Schedules the next attempt after a failed one, or at the unix time at without counting one."""
+        if at is None:
+            job.attempt += 1
+        job.next_attempt_at = at or time.time() + backoff(job.attempt)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET attempt = ?, next_attempt_at = ? WHERE cid = ? AND destination = ?",
+                (job.attempt, job.next_attempt_at, job.cid, int(job.destination))
+            )
+
+    def remove(self, job):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE cid = ? AND destination = ?", (job.cid, int(job.destination))
+            )
+            still_queued = self._conn.execute("SELECT 1 FROM jobs WHERE cid = ?", (job.cid,)).fetchone()
+        if not still_queued:
+            shutil.rmtree(os.path.join(self.media_path, job.cid), ignore_errors=True)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def _keep_media(self, post_obj):
+        # Downloaded images are deleted after every run, so a retry downloads them again from their url.
+        # Files without a url (converted videos) are copied next to the queue until the job is done.
+        data = post_obj.to_dict()
+        for media in data["media"]:
+            if media["url"]:
+                media["filename"] = None
+            elif media["filename"] and os.path.exists(media["filename"]):
+                directory = os.path.join(self.media_path, post_obj.id)
+                os.makedirs(directory, exist_ok=True)
+                kept = os.path.join(directory, os.path.basename(media["filename"]))
+                shutil.copyfile(media["filename"], kept)
+                media["filename"] = kept
+        return data
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
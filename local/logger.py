@@ -0,0 +1,288 @@
+from settings.paths import log_path
+import settings.settings as settings
+import atexit
+import bisect
+import collections
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from dateutil import tz as dateutil_tz
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Backend of write_log. Messages are put in a queue and written by a background thread, so logging
+# costs the caller little more than appending to a list. The thread wakes up every FLUSH_INTERVAL
+# seconds (at once for errors), writes everything queued since in one go and flushes the file, which
+# stays open until the day changes and the next day's file is started.
+#
+# Every day has a file of records, one json object per line ({"ts", "time", "type", "message"}), and an
+# index next to it with the time and byte offset of every record, in order. Reading the logs of the last
+# hours, the last few records or what was logged after a cursor (read_logs) looks up where to start in
+# the index and seeks there, so it costs the same no matter how large the log has grown. Days logged
+# before there was an index (plain .log files) are still read, by parsing them line by line.
+#
+# Other processes (the backup run from cron, scripts) log to the same files. Every batch is written under
+# a lock on the index and starts at the end of the file as it is then, so their records don't overlap.
+
+FLUSH_INTERVAL = 0.5
+LOG_EXTENSION = ".jsonl"
+INDEX_EXTENSION = ".idx"
+# Unix time and byte offset of a record
+INDEX_ENTRY = struct.Struct("<dQ")
+# Plain text logs written before the logs were indexed, "MM/DD/YYYY HH:MM:SS (TYPE): message" per line
+LEGACY_EXTENSION = ".log"
+LEGACY_LINE = re.compile(r"(\d\d/\d\d/\d{4} \d\d:\d\d:\d\d) \((\w+)\): (.*)")
+
+
+class LogWriter:
+    def __init__(self, directory=log_path, echo=True):
+        self.directory = directory
+        self.echo = echo
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._index = None
+        self._date = None
+        self._last_ts = 0
+        self._zone = None
+        self._zone_name = None
+
+    def write(self, type, message):
+        self._queue.append((time.time(), type, str(message)))
+        if self._thread is None:
+            self._start()
+        if type == "error":
+            self._wake.set()
+
+    def flush(self):
+        """Writes everything queued so far. Called by the background thread, and at exit."""
+        with self._write_lock:
+            days = {}
+            second = None
+            while self._queue:
+                timestamp, type, message = self._queue.popleft()
+                # Messages from different threads can be queued a little out of order, the index has
+                # to stay sorted
+                timestamp = max(timestamp, self._last_ts)
+                self._last_ts = timestamp
+                if int(timestamp) != second:
+                    # Messages logged within the same second share the time and date
+                    second = int(timestamp)
+                    local = datetime.fromtimestamp(second, self._get_zone())
+                    now = local.strftime("%m/%d/%Y %H:%M:%S")
+                    batch = days.setdefault(local.strftime("%y%m%d"), [])
+                batch.append({"ts": timestamp, "time": now, "type": type.upper(), "message": message})
+            for date, records in days.items():
+                if self.echo:
+                    sys.stdout.write("".join(format_record(record) + "\n" for record in records))
+                self._write_day(date, records)
+            if days and self.echo:
+                sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            if self._file:
+                self._file.close()
+                self._index.close()
+                self._file = None
+                self._index = None
+                self._date = None
+
+    def _write_day(self, date, records):
+        if date != self._date:
+            if self._file:
+                self._file.close()
+                self._index.close()
+            path = self.directory + date
+            self._file = open(path + LOG_EXTENSION, 'ab')
+            self._index = open(path + INDEX_EXTENSION, 'ab')
+            self._date = date
+        if fcntl:
+            fcntl.flock(self._index, fcntl.LOCK_EX)
+        try:
+            # Another process may have written since our last batch
+            offset = os.fstat(self._file.fileno()).st_size
+            size = os.fstat(self._index.fileno()).st_size
+            last_ts = 0
+            if size >= INDEX_ENTRY.size:
+                with open(self._index.name, 'rb') as index:
+                    index.seek(size - size % INDEX_ENTRY.size - INDEX_ENTRY.size)
+                    last_ts = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+            data = bytearray()
+            entries = bytearray()
+            for record in records:
+                # The index stays sorted when the other process logged a little later than us
+                record["ts"] = max(record["ts"], last_ts)
+                entries += INDEX_ENTRY.pack(record["ts"], offset + len(data))
+                data += json.dumps(record, ensure_ascii=False).encode("UTF-8") + b"\n"
+            self._file.write(data)
+            self._file.flush()
+            # The index is written after the records it points to
+            self._index.write(entries)
+            self._index.flush()
+        finally:
+            if fcntl:
+                fcntl.flock(self._index, fcntl.LOCK_UN)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                sys.stderr.write(f"Failed to write log: {e}\n")
+
+    def _get_zone(self):
+        # Use configured timezone (default US/Pacific)
+        name = getattr(settings, 'TIMEZONE', 'US/Pacific')
+        if name != self._zone_name:
+            self._zone = dateutil_tz.gettz(name) or dateutil_tz.UTC
+            self._zone_name = name
+        return self._zone
+
+
+def format_record(record):
+    return record["time"] + " (" + record["type"] + "): " + record["message"]
+
+
+class _Index:
+    """The index of a day as a read-only sequence of (ts, offset), read from disk entry by entry."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._length = os.fstat(self._file.fileno()).st_size // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        self._file.seek(i * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self._file.read(INDEX_ENTRY.size))
+
+    def close(self):
+        self._file.close()
+
+
+def read_logs(since=None, limit=0, after=None, directory=log_path):
+    """Returns the log records logged after the unix time since, or after the cursor after, oldest
+    first. With limit only the last limit of them. Spans as many days as needed. Also returns the
+    cursor to pass as after to get only the records logged after these."""
+    dates = sorted({os.path.splitext(name)[0] for name in os.listdir(directory)
+                    if name.endswith((INDEX_EXTENSION, LEGACY_EXTENSION))}, reverse=True)
+    after_date, after_offset = after.split(":") if after else ("", "0")
+    # Raises ValueError for a cursor that wasn't returned by read_logs
+    after_offset = int(after_offset)
+    cursor = after
+    days = []
+    remaining = limit
+    for date in dates:
+        if date < after_date:
+            break
+        day = []
+        # Time of the oldest record of the day
+        oldest = None
+        if os.path.exists(directory + date + INDEX_EXTENSION):
+            index = _Index(directory + date + INDEX_EXTENSION)
+            try:
+                # Only indexed records count, a record is indexed right after it is written
+                count = len(index)
+                if date == dates[0]:
+                    cursor = f"{date}:{index[count - 1][1] + 1 if count else 0}"
+                if count:
+                    oldest = index[0][0]
+                    start = 0
+                    if since is not None:
+                        start = bisect.bisect_right(index, since, key=lambda entry: entry[0])
+                    if date == after_date:
+                        start = max(start, bisect.bisect_left(index, after_offset, key=lambda entry: entry[1]))
+                    if limit:
+                        start = max(start, count - remaining)
+                    if start < count:
+                        with open(directory + date + LOG_EXTENSION, 'rb') as file:
+                            file.seek(index[start][1])
+                            day = _decode(file.read().splitlines()[:count - start])
+            finally:
+                index.close()
+        elif date == dates[0]:
+            cursor = f"{date}:0"
+        # A plain log is older than the indexed records of its day and isn't written to anymore, so there
+        # is nothing new in it after a cursor into its day
+        if date != after_date and os.path.exists(directory + date + LEGACY_EXTENSION) \
+                and not (limit and len(day) >= remaining):
+            legacy = _read_legacy(directory + date + LEGACY_EXTENSION)
+            if legacy:
+                oldest = legacy[0]["ts"]
+            if since is not None:
+                legacy = [record for record in legacy if record["ts"] > since]
+            day = legacy + day
+        if day:
+            days.append(day)
+            remaining -= len(day)
+        # Older days only have older records
+        if (limit and remaining <= 0) or (since is not None and oldest is not None and oldest <= since) \
+                or date == after_date:
+            break
+    records = [record for day in reversed(days) for record in day]
+    if limit:
+        records = records[-limit:]
+    return records, cursor
+
+
+def _decode(lines):
+    # A damaged line (written over by another process before the writes were locked) is left out
+    records = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and "message" in record:
+            records.append(record)
+    return records
+
+
+def _read_legacy(path):
+    # Records of a plain text log, lines that don't start with a time continue the message before them
+    zone = dateutil_tz.gettz(getattr(settings, 'TIMEZONE', 'US/Pacific')) or dateutil_tz.UTC
+    records = []
+    with open(path, 'r', encoding="UTF-8", errors="replace") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            match = LEGACY_LINE.match(line)
+            if match:
+                now, type, message = match.groups()
+                timestamp = datetime.strptime(now, "%m/%d/%Y %H:%M:%S").replace(tzinfo=zone).timestamp()
+                records.append({"ts": timestamp, "time": now, "type": type, "message": message})
+            elif records:
+                records[-1]["message"] += "\n" + line
+    return records
+
+
+_writer = None
+
+
+def get_log_writer():
+    global _writer
+    if _writer is None:
+        _writer = LogWriter()
+    return _writer
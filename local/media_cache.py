@@ -0,0 +1,226 @@
+from settings.paths import image_path
+from settings import settings
+from local.functions import write_log
+import hashlib
+import json
+import os
+import shutil
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Cache of downloaded media in the images folder. Files are named after a hash of their content, so the
+# same image is only stored once no matter how many urls point to it, and an index maps every url that
+# was downloaded to its file. Retries, reposts and every destination of a post reuse the file instead of
+# downloading it again. Instead of emptying the folder after every run, the least recently used files are
+# deleted once the folder grows past media_cache_size.
+
+INDEX_NAME = "media_cache.json"
+CHUNK_SIZE = 1 << 16
+
+
+class DownloadTooLarge(Exception):
+    pass
+
+
+class _Budget:
+    """Bytes a post may still download, shared by the downloads of its media."""
+
+    def __init__(self, limit):
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def take(self, size):
+        with self._lock:
+            if size > self.remaining:
+                return False
+            self.remaining -= size
+            return True
+
+
+def content_hash(path):
+    """Hash identifying a media file by its content. Free for files in the cache (it's their name)."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if len(name) == 64 and all(c in "0123456789abcdef" for c in name):
+        return name
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    def __init__(self, directory=image_path):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._index = None
+        self._session = None
+        self._pool = None
+
+    def get(self, url):
+        """Returns the cached file for url, or None."""
+        with self._lock:
+            name = self._load().get(url)
+            if not name:
+                return None
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                del self._index[url]
+                return None
+        # The modification time is when the file was last used, for evict()
+        os.utime(path)
+        return path
+
+    def fetch(self, url, ext=".jpg", budget=None):
+        """Returns the local path of url, downloading it unless it is cached."""
+        path = self.get(url)
+        if path:
+            write_log(f"Using cached copy of {url}")
+            if budget is not None and not budget.take(os.path.getsize(path)):
+                raise DownloadTooLarge(f"{url} would take the post over {settings.max_post_download} MB")
+            return path
+        tmp = os.path.join(self.directory, f".download-{threading.get_ident()}-{time.time_ns()}{ext}")
+        try:
+            digest = self._download(url, tmp, budget)
+            return self.add(url, tmp, digest, ext)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def fetch_all(self, items):
+        """Downloads all media of a post at once. items is a list of (url, ext), returns their local paths
+        in the same order, with None for those that failed. All of them together are limited to
+        max_post_download megabytes."""
+        budget = _Budget(settings.max_post_download * 1024 * 1024)
+
+        def fetch_one(item):
+            try:
+                return self.fetch(*item, budget=budget)
+            except Exception as e:
+                write_log(f"Failed to download {item[0]}: {e}", "error")
+                return None
+
+        if len(items) <= 1:
+            return [fetch_one(item) for item in items]
+        return list(self._get_pool().map(fetch_one, items))
+
+    def add(self, url, tmp, digest, ext):
+        """Moves the downloaded file tmp into the cache under its content hash and indexes url."""
+        name = digest + ext
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.replace(tmp, path)
+        with self._lock:
+            self._load()[url] = name
+            self._save()
+        return path
+
+    def evict(self, max_bytes=None):
+        """Deletes the least recently used files until the folder is below max_bytes (media_cache_size)."""
+        if max_bytes is None:
+            max_bytes = settings.media_cache_size * 1024 * 1024
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name in (".gitignore", ".keep", INDEX_NAME):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            stat = entry.stat()
+            if entry.name.startswith(".download-") and time.time() - stat.st_mtime < 3600:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                removed += 1
+            except OSError as e:
+                write_log('Failed to delete %s. Reason: %s' % (path, e), "error")
+        with self._lock:
+            index = self._load()
+            for url in [url for url, name in index.items()
+                        if not os.path.exists(os.path.join(self.directory, name))]:
+                del index[url]
+            self._save()
+        if removed:
+            write_log(f"Deleted {removed} least recently used files from the media cache")
+        return removed
+
+    def _download(self, url, path, budget=None):
+        # Streamed to disk in chunks, so a large video never has to fit in memory
+        max_size = settings.max_file_download * 1024 * 1024
+        started = time.monotonic()
+        deadline = started + settings.download_timeout
+        digest = hashlib.sha256()
+        size = 0
+        with self._get_session().get(url, stream=True, timeout=(10, settings.download_timeout)) as response:
+            response.raise_for_status()
+            length = int(response.headers.get("Content-Length") or 0)
+            if length > max_size:
+                raise DownloadTooLarge(f"{url} is {length} bytes, more than {settings.max_file_download} MB")
+            with open(path, 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise DownloadTooLarge(f"{url} is more than {settings.max_file_download} MB")
+                    if budget is not None and not budget.take(len(chunk)):
+                        raise DownloadTooLarge(f"{url} would take the post over {settings.max_post_download} MB")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Downloading {url} took more than {settings.download_timeout} seconds")
+                    digest.update(chunk)
+                    file.write(chunk)
+        write_log(f"Downloaded {url} ({size} bytes) in {time.monotonic() - started:.2f}s")
+        return digest.hexdigest()
+
+    def _get_session(self):
+        # One session for all downloads, so connections to the same host are reused
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=settings.download_workers, pool_maxsize=settings.download_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=settings.download_workers, thread_name_prefix="download")
+        return self._pool
+
+    def _load(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r') as file:
+                    self._index = json.load(file)
+            except (FileNotFoundError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w') as file:
+            json.dump(self._index, file)
+        os.replace(tmp, self.index_path)
+
+
+_cache = None
+
+
+def get_media_cache():
+    global _cache
+    if _cache is None:
+        _cache = MediaCache()
+    return _cache
@@ -0,0 +1,48 @@
+from settings.paths import media_ids_path
+from local.ttl_cache import TtlCache
+from local.media_cache import content_hash
+from models.entry import Destination
+
+# Ids that media got when it was uploaded to a destination, keyed by the hash of the file, so a retry
+# after a partial failure or a repost of the same media doesn't upload it again. Each service only lets
+# an upload be reused for a while, entries expire before that.
+EXPIRY = {
+    # Media ids can be used for 24 hours after the upload
+    Destination.TWITTER: 23 * 3600,
+    # Uploads that aren't attached to a status are deleted after about a day, and can't be reused once they
+    # are attached (see forget_media_ids)
+    Destination.MASTODON: 12 * 3600,
+    # Blobs that no record refers to are garbage collected after a few hours
+    Destination.BSKY: 2 * 3600,
+    # file_ids don't expire
+    Destination.TELEGRAM: 30 * 86400,
+}
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TtlCache(media_ids_path)
+    return _cache
+
+
+def _key(destination, filename):
+    return f"{destination.fail_key}:{content_hash(filename)}"
+
+
+def remote_media_id(destination, filename, alt=""):
+    """Returns the id filename got when it was last uploaded to destination with the same alt text, or None."""
+    cached = _get_cache().get(_key(destination, filename), None)
+    if cached is None or cached[1] != (alt or ""):
+        return None
+    return cached[0]
+
+
+def remember_media_id(destination, filename, media_id, alt=""):
+    _get_cache().set(_key(destination, filename), [media_id, alt or ""], EXPIRY[destination])
+
+
+def forget_media_ids(destination, filenames):
+    _get_cache().delete(*[_key(destination, filename) for filename in filenames])
@@ -0,0 +1,141 @@
+from settings import settings
+from local.functions import write_log
+from local.media_cache import content_hash
+from models.entry import Destination
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Every destination has its own limits for images. Before a post is sent, prepare_media works out which
+# destinations can't take an image as it is and makes a copy that fits (scaled down and/or re-encoded as
+# JPEG, which also drops its EXIF data). Copies are made on a process pool, so large images are resized
+# on several cores at once, and each one only once: they are stored next to the original in the images
+# folder, named after the original's content hash and the limits, and reused by destinations with the
+# same limits, retries and later runs. Without Pillow installed images are sent as they are. The workers
+# are started from a fork server rather than forked from this (threaded) process, which could deadlock.
+
+MB = 1024 * 1024
+# Largest file size in bytes, longest side in pixels and the formats each destination takes
+LIMITS = {
+    Destination.TWITTER: (5 * MB, 8192, {"JPEG", "PNG", "GIF", "WEBP"}),
+    Destination.MASTODON: (16 * MB, 8192, {"JPEG", "PNG", "GIF", "WEBP"}),
+    Destination.DISCORD: (10 * MB, None, {"JPEG", "PNG", "GIF", "WEBP"}),
+    Destination.TUMBLR: (20 * MB, None, {"JPEG", "PNG", "GIF"}),
+    # Blobs in image embeds can be at most 1,000,000 bytes, the app shows them at up to 2000 pixels
+    Destination.BSKY: (1000000, 2000, {"JPEG", "PNG", "WEBP"}),
+    # sendPhoto takes 10 MB, and width and height may add up to 10000 pixels at most
+    Destination.TELEGRAM: (10 * MB, 5000, {"JPEG", "PNG", "WEBP"}),
+}
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".webm")
+# Files in the media cache are named after their content hash
+CACHED_NAME = re.compile(r"[0-9a-f]{64}")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=settings.media_prep_workers,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def prepare_media(images, destinations):
+    """Returns {destination: list of image dicts} with every image within that destination's limits,
+    for every destination (those not in destinations get images unchanged)."""
+    prepared = {destination: images for destination in Destination}
+    if not images or Image is None:
+        return prepared
+    jobs = {}
+    plans = {}
+    for destination in destinations:
+        if destination not in LIMITS:
+            continue
+        plan = []
+        for image in images:
+            target = _variant_path(image["filename"], *LIMITS[destination])
+            plan.append(target)
+            if target and target not in jobs and not os.path.exists(target):
+                jobs[target] = (image["filename"], target) + LIMITS[destination][:2]
+        plans[destination] = plan
+    if jobs:
+        futures = {target: _get_pool().submit(make_variant, *args) for target, args in jobs.items()}
+        for target, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                write_log(f"Failed to prepare {jobs[target][0]}: {e}", "error")
+    for destination, plan in plans.items():
+        prepared[destination] = [
+            dict(image, filename=target) if target and os.path.exists(target) else image
+            for image, target in zip(images, plan)
+        ]
+    return prepared
+
+
+def _variant_path(filename, max_bytes, max_side, formats):
+    # Path of the copy of filename that fits the limits, or None if it fits them as it is
+    if not filename or filename.lower().endswith(VIDEO_EXTENSIONS):
+        return None
+    try:
+        with Image.open(filename) as image:
+            if getattr(image, "is_animated", False):
+                # Re-encoding would lose the animation
+                return None
+            fits = (image.format in formats and os.path.getsize(filename) <= max_bytes
+                    and (not max_side or max(image.size) <= max_side)
+                    and not (settings.strip_metadata and image.getexif()))
+    except Exception as e:
+        write_log(f"Unable to read image {filename}: {e}", "warning")
+        return None
+    if fits:
+        return None
+    digest = os.path.splitext(os.path.basename(filename))[0]
+    if not CACHED_NAME.fullmatch(digest):
+        digest = content_hash(filename)
+    name = f"{digest}-{max_side or 0}-{max_bytes}.jpg"
+    return os.path.join(os.path.dirname(filename), name)
+
+
+def make_variant(filename, target, max_bytes, max_side):
+    """Writes filename to target as a JPEG of at most max_bytes and max_side pixels. Runs in a worker process."""
+    with Image.open(filename) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+    if max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    quality = 90
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes or min(image.size) <= 16:
+            break
+        # Lower the quality a bit first, then scale down
+        if quality > 60:
+            quality -= 10
+        else:
+            image = image.resize((int(image.width * 0.75), int(image.height * 0.75)), Image.LANCZOS)
+            quality = 85
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(tmp, target)
+    return target
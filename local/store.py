@@ -0,0 +1,781 @@
+from settings.paths import database_path, sqlite_path, archive_path
+from settings import settings
+from local.functions import write_log
+from models.entry import DbEntry
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from contextlib import contextmanager
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+# Storage backends for the database of crossposted posts. Every backend maps the id of a source post
+# ("skeet") to a DbEntry with the ids it got on each destination and a counter of failed attempts per
+# destination. On disk a row is still stored as json:
+#   {"ids": {"twitter_id": ..., ...}, "failed": {"twitter": 0, ...}}
+# DatabaseManager and local.db both go through get_store(), so they always share the same backend.
+
+# A changed entry is appended to the json database as a new row, which leaves the old row behind. Once
+# there are at least COMPACT_MIN_DUPLICATES such outdated rows, and more of them than current ones, the
+# file is rewritten with only the current row of every entry.
+COMPACT_MIN_DUPLICATES = 1000
+
+
+# After changing from camelCase to snake_case, old database entries will have to be converted.
+def convert_ids(ids_in):
+    ids_out = {}
+    ids_out["twitter_id"] = ids_in.get("twitter_id") or ids_in.get("twitterId", "")
+    ids_out["mastodon_id"] = ids_in.get("mastodon_id") or ids_in.get("mastodonId", "")
+    ids_out["discord_id"] = ids_in.get("discord_id") or ids_in.get("discordId", "")
+    ids_out["tumblr_id"] = ids_in.get("tumblr_id") or ids_in.get("tumblrId", "")
+    ids_out["bsky_id"] = ids_in.get("bsky_id") or ids_in.get("bskyId", "")
+    ids_out["telegram_id"] = ids_in.get("telegram_id") or ids_in.get("telegramId", "")
+    return ids_out
+
+
+def make_entry(ids, failed, created_at=0):
+    """Normalizes stored ids and failure counters into a database entry."""
+    return DbEntry(convert_ids(ids or {}), failed, created_at)
+
+
+def parse_row(line):
+    """Parses one line of the json database. Returns (skeet, entry), or None for unusable lines."""
+    try:
+        json_line = json.loads(line)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(json_line, dict) or "skeet" not in json_line:
+        return None
+    return json_line["skeet"], make_entry(json_line.get("ids", {}), json_line.get("failed"), json_line.get("created"))
+
+
+def serialize_row(skeet, entry):
+    if not isinstance(entry, DbEntry):
+        entry = make_entry(entry["ids"], entry["failed"])
+    row = {"skeet": skeet, **entry.to_dict()}
+    if entry.created_at:
+        row["created"] = entry.created_at
+    return json.dumps(row)
+
+
+def row_digest(text):
+    """Short, stable digest of a serialized row, used to tell if a row has changed."""
+    if isinstance(text, str):
+        text = text.encode("UTF-8")
+    return hashlib.blake2b(text, digest_size=8).digest()
+
+
+class LazyDatabase(Mapping):
+    """Dict-like view of a store that only decodes the entries that are looked up.
+
+    Entries assigned to it are kept in memory and remembered as dirty, so save() only has to write
+    those. Iterating over it goes through every stored key and is as slow as a full load.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._entries = {}
+        self.dirty = set()
+
+    def __getitem__(self, skeet):
+        if skeet not in self._entries:
+            if not isinstance(skeet, str):
+                raise KeyError(skeet)
+            entry = self._store.fetch(skeet)
+            if entry is None:
+                raise KeyError(skeet)
+            self._entries[skeet] = entry
+        return self._entries[skeet]
+
+    def __setitem__(self, skeet, entry):
+        self._entries[skeet] = entry
+        self.dirty.add(skeet)
+
+    def __contains__(self, skeet):
+        try:
+            self[skeet]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        stored = set()
+        for skeet in self._store.keys():
+            stored.add(skeet)
+            yield skeet
+        for skeet in list(self._entries):
+            if skeet not in stored:
+                yield skeet
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def key_digest(skeet):
+    return int.from_bytes(row_digest(skeet), "little")
+
+
+class OffsetIndex:
+    """Compact skeet -> byte offset table for the json database.
+
+    Keys are 64-bit digests of the skeet, kept sorted next to the offset of the newest line for that
+    skeet, so a lookup is a binary search and an entry costs 16 bytes. size is how much of the file
+    has been indexed and rows how many rows that part holds, outdated ones included. The table is
+    persisted next to the database so it is only built once.
+    """
+
+    _HEADER = struct.Struct("<8sQQ8sQ")
+    _MAGIC = b"SRIDX002"
+
+    def __init__(self, keys=None, offsets=None, size=0, rows=0):
+        self.keys = keys if keys is not None else array("Q")
+        self.offsets = offsets if offsets is not None else array("Q")
+        self.size = size
+        self.rows = rows
+
+    @classmethod
+    def from_dict(cls, offsets_by_key, size, rows):
+        keys = array("Q", sorted(offsets_by_key))
+        return cls(keys, array("Q", (offsets_by_key[k] for k in keys)), size, rows)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.offsets[i]
+        return None
+
+    def set(self, key, offset):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.offsets[i] = offset
+        else:
+            self.keys.insert(i, key)
+            self.offsets.insert(i, offset)
+
+    def write(self, path, check):
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as file:
+            file.write(self._HEADER.pack(self._MAGIC, self.size, len(self.keys), check, self.rows))
+            self.keys.tofile(file)
+            self.offsets.tofile(file)
+        os.replace(tmp, path)
+
+    @classmethod
+    def read(cls, path):
+        """Returns (index, check) from a persisted index, or (None, None) if it can't be used."""
+        try:
+            with open(path, 'rb') as file:
+                magic, size, count, check, rows = cls._HEADER.unpack(file.read(cls._HEADER.size))
+                if magic != cls._MAGIC:
+                    return None, None
+                keys = array("Q")
+                keys.fromfile(file, count)
+                offsets = array("Q")
+                offsets.fromfile(file, count)
+        except (OSError, EOFError, struct.error):
+            return None, None
+        return cls(keys, offsets, size, rows), check
+
+
+class JsonlStore:
+    """The legacy backend: one json object per line. Saving appends a row for every changed entry, the
+    newest row of an entry is the one that counts.
+
+    With load_lazy() the file is memory-mapped instead and rows are found through an OffsetIndex,
+    and only decoded when they are looked up.
+    """
+
+    _SKEET_PREFIX = b'{"skeet": "'
+
+    def __init__(self, path=database_path, archive_path=None):
+        self.path = path
+        self.index_path = path + ".idx"
+        # Segment that old entries are moved to, see archive_older_than()
+        self.archive = JsonlStore(archive_path) if archive_path else None
+        self._lock = threading.RLock()
+        # Digest of the newest row of every skeet, so duplicate checks don't have to read the file,
+        # and how many rows the file holds, outdated ones included.
+        self._digests = None
+        self._rows = 0
+        # Set by load_lazy()
+        self._index = None
+        self._mm = None
+
+    def load(self):
+        with self._lock:
+            self._close_index()
+            database = {}
+            digests = {}
+            rows = 0
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as file:
+                    for line in file:
+                        row = parse_row(line)
+                        if row:
+                            database[row[0]] = row[1]
+                            digests[row[0]] = row_digest(line.rstrip("\n"))
+                            rows += 1
+            self._digests = digests
+            self._rows = rows
+            return database
+
+    def load_lazy(self):
+        with self._lock:
+            self._open_index()
+            return LazyDatabase(self)
+
+    def fetch(self, skeet):
+        with self._lock:
+            if self._index is None:
+                self._open_index()
+            offset = self._index.get(key_digest(skeet))
+            if offset is None:
+                return None
+            row = parse_row(self._read_line(offset))
+        if not row or row[0] != skeet:
+            return None
+        return row[1]
+
+    def keys(self):
+        seen = set()
+        for skeet, _ in self._hot_rows():
+            if skeet not in seen:
+                seen.add(skeet)
+                yield skeet
+
+    def upsert(self, skeet, entry):
+        json_string = serialize_row(skeet, entry)
+        with self._lock:
+            if self.contains_row(json_string):
+                return False
+            write_log("Adding to database: " + json_string)
+            with open(self.path, 'ab') as file:
+                offset = file.tell()
+                file.write((json_string + "\n").encode("UTF-8"))
+            if self._index is not None:
+                self._index.set(key_digest(skeet), offset)
+                self._index.rows += 1
+                if self._index.size == offset:
+                    self._index.size = offset + len(json_string) + 1
+            else:
+                self._digests[skeet] = row_digest(json_string)
+                self._rows += 1
+            return True
+
+    def save(self, database):
+        with self._lock:
+            if isinstance(database, LazyDatabase):
+                for skeet in list(database.dirty):
+                    self.upsert(skeet, database[skeet])
+                database.dirty.clear()
+                duplicates = self._index.rows - len(self._index)
+                if duplicates >= COMPACT_MIN_DUPLICATES and duplicates > len(self._index):
+                    self._compact_lazy(duplicates)
+                self._write_index()
+                return
+            if self._index is not None or self._digests is None:
+                self.load()
+            changed = []
+            for skeet, entry in database.items():
+                json_string = serialize_row(skeet, entry)
+                digest = row_digest(json_string)
+                if self._digests.get(skeet) != digest:
+                    changed.append((skeet, json_string, digest))
+            if changed:
+                write_log(f"Saving {len(changed)} changed database entries")
+                # Appending keeps the file, so backups only need the rows after their checkpoint (see
+                # changes_since)
+                with open(self.path, 'ab') as file:
+                    file.write("".join(json_string + "\n" for _, json_string, _ in changed).encode("UTF-8"))
+                for skeet, _, digest in changed:
+                    self._digests[skeet] = digest
+                self._rows += len(changed)
+            duplicates = self._rows - len(self._digests)
+            if duplicates >= COMPACT_MIN_DUPLICATES and duplicates > len(self._digests):
+                write_log(f"Compacting database, dropping {duplicates} outdated rows")
+                self._rewrite(database)
+
+    def _rewrite(self, database):
+        with self._lock:
+            self._close_index()
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            digests = {}
+            # The new file replaces the old one, so backups can tell it was rewritten (see changes_since).
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w') as file:
+                for skeet, entry in database.items():
+                    json_string = serialize_row(skeet, entry)
+                    file.write(json_string + "\n")
+                    digests[skeet] = row_digest(json_string)
+            os.replace(tmp, self.path)
+            self._digests = digests
+            self._rows = len(digests)
+
+    def replace_all(self, database):
+        if self.archive is not None:
+            self.archive.replace_all({})
+        self._rewrite(dict(database))
+
+    def archive_older_than(self, cutoff):
+        """Moves entries created before cutoff (unix time) to the archive. Returns how many were moved."""
+        if self.archive is None:
+            return 0
+        with self._lock:
+            database = self.load()
+            now = int(time.time())
+            old = []
+            unstamped = False
+            for skeet, entry in database.items():
+                if not entry.created_at:
+                    # Entries from before creation times were recorded start their clock now.
+                    entry.created_at = now
+                    unstamped = True
+                elif entry.created_at < cutoff:
+                    old.append(skeet)
+            if not old and not unstamped:
+                return 0
+            self.archive.append_rows((skeet, database.pop(skeet)) for skeet in old)
+            self._rewrite(database)
+            return len(old)
+
+    def fetch_archived(self, skeet):
+        if self.archive is None:
+            return None
+        return self.archive.fetch(skeet)
+
+    def append_rows(self, rows):
+        with self._lock:
+            with open(self.path, 'ab') as file:
+                for skeet, entry in rows:
+                    offset = file.tell()
+                    file.write((serialize_row(skeet, entry) + "\n").encode("UTF-8"))
+                    if self._index is not None:
+                        self._index.set(key_digest(skeet), offset)
+                        self._index.rows += 1
+            self._digests = None
+
+    def contains_row(self, json_string):
+        """Checks if exactly this row is already in the file."""
+        row = parse_row(json_string)
+        if not row:
+            return False
+        with self._lock:
+            if self._index is not None:
+                return self.fetch(row[0]) == row[1]
+            if self._digests is None:
+                self.load()
+            return self._digests.get(row[0]) == row_digest(json_string)
+
+    def rows(self):
+        # Archived rows come first, so a newer row in the main file wins when both are replayed.
+        if self.archive is not None:
+            yield from self.archive.rows()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                row = parse_row(line)
+                if row:
+                    yield row
+
+    def count(self):
+        count = self.archive.count() if self.archive is not None else 0
+        with self._lock:
+            if self._index is not None:
+                return count + len(self._index)
+            if self._digests is not None:
+                return count + len(self._digests)
+        # Outdated rows of an entry don't count
+        return count + sum(1 for _ in self.keys())
+
+    def checkpoint(self):
+        """Marks the current end of the file, for changes_since()."""
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return {"inode": stat.st_ino, "size": stat.st_size}
+
+    def changes_since(self, checkpoint):
+        """Returns the rows appended since checkpoint, or None if the file has been rewritten since."""
+        if not isinstance(checkpoint, dict) or not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        if stat.st_ino != checkpoint["inode"] or stat.st_size < checkpoint["size"]:
+            return None
+        changes = {}
+        with open(self.path, 'rb') as file:
+            file.seek(checkpoint["size"])
+            for line in file:
+                row = parse_row(line)
+                if row:
+                    changes[row[0]] = row[1]
+        return list(changes.items())
+
+    @contextmanager
+    def transaction(self):
+        # Every append is written straight to the file, so there is nothing to group.
+        yield self
+
+    def _hot_rows(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                row = parse_row(line)
+                if row:
+                    yield row
+
+    def _open_index(self):
+        """Maps the file and brings the offset index up to date, scanning only unindexed rows."""
+        self._close_index()
+        self._digests = None
+        self._map()
+        size = len(self._mm) if self._mm is not None else 0
+        index, check = OffsetIndex.read(self.index_path)
+        if index is not None and (index.size > size or check != self._check(index.size)):
+            write_log("Database index is out of date, rebuilding it")
+            index = None
+        if index is None:
+            offsets = {}
+            indexed, rows = self._scan(0, size, offsets.__setitem__)
+            self._index = OffsetIndex.from_dict(offsets, indexed, rows)
+            write_log(f"Indexed {len(self._index)} database entries")
+            self._write_index()
+        else:
+            indexed, rows = self._scan(index.size, size, index.set)
+            self._index = index
+            if indexed != index.size:
+                index.size = indexed
+                index.rows += rows
+                self._write_index()
+
+    def _close_index(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = None
+        self._index = None
+
+    def _write_index(self):
+        if self._index is not None:
+            self._map()
+            self._index.write(self.index_path, self._check(self._index.size))
+
+    def _map(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as file:
+                self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _check(self, size):
+        # Fingerprint of the end of the indexed part of the file, to notice if it was rewritten.
+        if self._mm is None or size == 0:
+            return bytes(8)
+        return row_digest(self._mm[max(0, size - 256):size])
+
+    def _scan(self, start, end, add):
+        """Adds the offset of every complete line between start and end. Returns the end of the last one
+        and how many rows were found."""
+        pos = start
+        rows = 0
+        while pos < end:
+            newline = self._mm.find(b"\n", pos, end)
+            if newline == -1:
+                break
+            skeet = self._line_skeet(self._mm[pos:newline])
+            if skeet is not None:
+                add(key_digest(skeet), pos)
+                rows += 1
+            pos = newline + 1
+        return pos, rows
+
+    def _compact_lazy(self, duplicates):
+        # Copies the newest row of every entry to a new file, in the order they were written
+        write_log(f"Compacting database, dropping {duplicates} outdated rows")
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as file:
+            for offset in sorted(self._index.offsets):
+                file.write(self._read_line(offset) + b"\n")
+        self._close_index()
+        os.replace(tmp, self.path)
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self._open_index()
+
+    def _line_skeet(self, line):
+        # Rows written by this program start with the skeet, so most lines don't need decoding.
+        if line.startswith(self._SKEET_PREFIX):
+            end = line.find(b'"', len(self._SKEET_PREFIX))
+            skeet = line[len(self._SKEET_PREFIX):end]
+            if end != -1 and b"\\" not in skeet:
+                return skeet.decode("UTF-8")
+        row = parse_row(line)
+        return row[0] if row else None
+
+    def _read_line(self, offset):
+        if self._mm is None or offset >= len(self._mm):
+            self._map()
+        end = self._mm.find(b"\n", offset)
+        return self._mm[offset:end if end != -1 else len(self._mm)]
+
+
+class SqliteStore:
+    """SQLite backend in WAL mode, keyed by skeet. Only rows that changed are written."""
+
+    def __init__(self, path=sqlite_path, import_path=database_path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Digest of every row as it is on disk, so unchanged rows can be skipped without a query.
+        self._digests = {}
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        is_new = not os.path.exists(path)
+        # isolation_level=None leaves transactions to us, see transaction().
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "skeet TEXT PRIMARY KEY, ids TEXT NOT NULL, failed TEXT NOT NULL, updated_at REAL)"
+        )
+        # Old entries are moved here by archive_older_than(), out of the way of everyday lookups.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS archive ("
+            "skeet TEXT PRIMARY KEY, ids TEXT NOT NULL, failed TEXT NOT NULL, updated_at REAL, created_at REAL)"
+        )
+        self._migrate()
+        if is_new and import_path and os.path.exists(import_path):
+            self._import_jsonl(import_path)
+
+    def load(self):
+        database = {}
+        digests = {}
+        with self._lock:
+            cursor = self._conn.execute("SELECT skeet, ids, failed, created_at FROM posts")
+            for skeet, ids, failed, created_at in cursor:
+                entry = make_entry(json.loads(ids), json.loads(failed), created_at)
+                database[skeet] = entry
+                digests[skeet] = self._digest(entry)
+            self._digests = digests
+        return database
+
+    def load_lazy(self):
+        with self._lock:
+            self._digests = {}
+        return LazyDatabase(self)
+
+    def fetch(self, skeet):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ids, failed, created_at FROM posts WHERE skeet = ?", (skeet,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = make_entry(json.loads(row[0]), json.loads(row[1]), row[2])
+            self._digests[skeet] = self._digest(entry)
+        return entry
+
+    def fetch_archived(self, skeet):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ids, failed, created_at FROM archive WHERE skeet = ?", (skeet,)
+            ).fetchone()
+        if row is None:
+            return None
+        return make_entry(json.loads(row[0]), json.loads(row[1]), row[2])
+
+    def archive_older_than(self, cutoff):
+        """Moves entries created before cutoff (unix time) to the archive. Returns how many were moved."""
+        with self._lock, self.transaction():
+            moved = [skeet for (skeet,) in self._conn.execute(
+                "SELECT skeet FROM posts WHERE created_at < ?", (cutoff,)
+            )]
+            if not moved:
+                return 0
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archive (skeet, ids, failed, updated_at, created_at) "
+                "SELECT skeet, ids, failed, updated_at, created_at FROM posts WHERE created_at < ?", (cutoff,)
+            )
+            self._conn.execute("DELETE FROM posts WHERE created_at < ?", (cutoff,))
+            for skeet in moved:
+                self._digests.pop(skeet, None)
+        return len(moved)
+
+    def keys(self):
+        with self._lock:
+            results = self._conn.execute("SELECT skeet FROM posts").fetchall()
+        for (skeet,) in results:
+            yield skeet
+
+    def upsert(self, skeet, entry):
+        ids, failed, digest = self._encode(entry)
+        with self._lock:
+            if skeet not in self._digests:
+                self.fetch(skeet)
+            if self._digests.get(skeet) == digest:
+                return False
+            now = time.time()
+            self._conn.execute(self._UPSERT, (skeet, ids, failed, now, getattr(entry, "created_at", 0) or now))
+            self._digests[skeet] = digest
+        write_log("Adding to database: " + serialize_row(skeet, entry))
+        return True
+
+    def save(self, database):
+        changed = []
+        with self._lock:
+            entries = database.items()
+            if isinstance(database, LazyDatabase):
+                entries = [(skeet, database[skeet]) for skeet in database.dirty]
+                database.dirty.clear()
+            for skeet, entry in entries:
+                ids, failed, digest = self._encode(entry)
+                if self._digests.get(skeet) != digest:
+                    changed.append((skeet, ids, failed, digest, getattr(entry, "created_at", 0)))
+            if not changed:
+                return
+            write_log(f"Saving {len(changed)} changed database entries")
+            now = time.time()
+            with self.transaction():
+                self._conn.executemany(self._UPSERT, [(*row[:3], now, row[4] or now) for row in changed])
+            for skeet, _, _, digest, _ in changed:
+                self._digests[skeet] = digest
+
+    def contains_row(self, json_string):
+        """Checks if exactly this row is already stored."""
+        row = parse_row(json_string)
+        if not row:
+            return False
+        return self._digests.get(row[0]) == self._digest(row[1])
+
+    def rows(self):
+        # Archived rows come first, so a newer row in posts wins when both are replayed.
+        with self._lock:
+            results = self._conn.execute(
+                "SELECT skeet, ids, failed, created_at FROM archive "
+                "UNION ALL SELECT skeet, ids, failed, created_at FROM posts"
+            ).fetchall()
+        for skeet, ids, failed, created_at in results:
+            yield skeet, make_entry(json.loads(ids), json.loads(failed), created_at)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM posts) + (SELECT COUNT(*) FROM archive)"
+            ).fetchone()[0]
+
+    def replace_all(self, database):
+        now = time.time()
+        with self._lock, self.transaction():
+            self._conn.execute("DELETE FROM posts")
+            self._conn.execute("DELETE FROM archive")
+            self._conn.executemany(self._UPSERT, [
+                (skeet, *self._encode(entry)[:2], now, getattr(entry, "created_at", 0) or now)
+                for skeet, entry in database.items()
+            ])
+            self._digests = {}
+
+    def checkpoint(self):
+        """Marks the current time, for changes_since()."""
+        return time.time()
+
+    def changes_since(self, checkpoint):
+        """Returns the rows written after checkpoint, or None if there is no usable checkpoint."""
+        if not isinstance(checkpoint, (int, float)):
+            return None
+        with self._lock:
+            results = self._conn.execute(
+                "SELECT skeet, ids, failed, created_at FROM posts WHERE updated_at > ?", (checkpoint,)
+            ).fetchall()
+        return [
+            (skeet, make_entry(json.loads(ids), json.loads(failed), created_at))
+            for skeet, ids, failed, created_at in results
+        ]
+
+    @contextmanager
+    def transaction(self):
+        """Groups all writes until the outermost transaction() exits into one SQLite transaction.
+
+        Posts that already went out are committed even if the run fails halfway, so they are not
+        sent again on the next run.
+        """
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._conn.execute("BEGIN")
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("COMMIT")
+
+    # created_at is only set when a row is first inserted.
+    _UPSERT = (
+        "INSERT INTO posts (skeet, ids, failed, updated_at, created_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(skeet) DO UPDATE SET ids = excluded.ids, failed = excluded.failed, "
+        "updated_at = excluded.updated_at"
+    )
+
+    def _migrate(self):
+        # Databases created by older versions lack some columns.
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(posts)")}
+        if "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE posts ADD COLUMN updated_at REAL")
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE posts ADD COLUMN created_at REAL")
+            # Entries from before creation times were recorded start their clock now.
+            self._conn.execute("UPDATE posts SET created_at = COALESCE(updated_at, ?)", (time.time(),))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS posts_created_at ON posts (created_at)")
+
+    def _digest(self, entry):
+        return self._encode(entry)[2]
+
+    def _encode(self, entry):
+        # Rows are stored normalized, so they compare equal to what load() and fetch() return.
+        if not isinstance(entry, DbEntry):
+            entry = make_entry(entry["ids"], entry["failed"])
+        row = entry.to_dict()
+        ids = json.dumps(row["ids"])
+        failed = json.dumps(row["failed"])
+        return ids, failed, row_digest(ids + failed)
+
+    def _import_jsonl(self, import_path):
+        imported = JsonlStore(import_path).load()
+        now = time.time()
+        with self.transaction():
+            self._conn.executemany(
+                self._UPSERT,
+                [(skeet, *self._encode(entry)[:2], None, entry.created_at or now) for skeet, entry in imported.items()]
+            )
+        write_log(f"Imported {len(imported)} entries from {import_path} into {self.path}")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(jsonl_path=database_path, sqlite_file=sqlite_path, backend=None, archive_file=archive_path):
+    """Returns the shared store for the configured backend, creating it on first use."""
+    backend = backend or settings.db_backend
+    key = (backend, sqlite_file if backend == "sqlite" else jsonl_path)
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "sqlite":
+                _stores[key] = SqliteStore(sqlite_file, import_path=jsonl_path)
+            else:
+                _stores[key] = JsonlStore(jsonl_path, archive_file)
+        return _stores[key]
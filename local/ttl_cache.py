@@ -0,0 +1,77 @@
+from local.functions import write_log
+import json
+import os
+import threading
+import time
+
+# Small persistent key-value cache where every entry expires after its own ttl. Kept as a json file that
+# is rewritten on every change, so it is meant for hundreds or a few thousand entries. A value of None
+# is a valid entry (remembering that something doesn't exist), get() tells it apart from a missing one
+# with the default argument.
+
+MISSING = object()
+
+
+class TtlCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def get(self, key, default=MISSING):
+        """Returns the value stored for key, or default if there is none or it has expired."""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.time():
+                del self._entries[key]
+                return default
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, values, ttl):
+        """Stores every key and value in values, all expiring in ttl seconds. Written to disk at once."""
+        if not values:
+            return
+        expires = time.time() + ttl
+        with self._lock:
+            entries = self._load()
+            for key, value in values.items():
+                entries[key] = [value, expires]
+            self._save()
+
+    def delete(self, *keys):
+        with self._lock:
+            entries = self._load()
+            if any([entries.pop(key, None) is not None for key in keys]):
+                self._save()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r') as file:
+                    self._entries = json.load(file)
+            except FileNotFoundError:
+                self._entries = {}
+            except ValueError as e:
+                write_log(f"Ignoring unreadable cache {self.path}: {e}", "warning")
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        now = time.time()
+        self._entries = {key: entry for key, entry in self._entries.items() if entry[1] >= now}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as file:
+            json.dump(self._entries, file)
+        os.replace(tmp, self.path)
@@ -0,0 +1,80 @@
+import mimetypes
+import os
+import uuid
+
+# Media is sent to destinations straight from disk: the body of a request is read in chunks of
+# CHUNK_SIZE bytes while it is being sent, and only one file is open at a time, so memory use doesn't
+# grow with the size or number of files (several large videos in a batch).
+
+CHUNK_SIZE = 1 << 16
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yields the content of path in chunks, for uploading it as the whole request body."""
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            yield chunk
+
+
+def mime_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class MultipartStream:
+    """A multipart/form-data request body that reads its files while it is sent. Passed to requests as
+    data (with content_type as the Content-Type header), it is sent with a Content-Length, as the
+    length is known up front.
+
+    fields is {name: value} of plain form fields, files is {name: path}."""
+
+    def __init__(self, fields=None, files=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        # Parts are either bytes or the path of a file to read
+        self._parts = []
+        for name, value in (fields or {}).items():
+            self._parts.append(self._header(name) + str(value).encode("UTF-8") + b"\r\n")
+        for name, path in (files or {}).items():
+            self._parts.append(self._header(name, os.path.basename(path), mime_type(path)))
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+        self.length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self._parts)
+        self._index = 0
+        self._buffer = b""
+        self._file = None
+
+    def _header(self, name, filename=None, content_type=None):
+        header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"'
+        if filename:
+            header += f'; filename="{filename}"\r\nContent-Type: {content_type}'
+        return (header + "\r\n\r\n").encode("UTF-8")
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        while len(self._buffer) < size and (self._file or self._index < len(self._parts)):
+            if self._file:
+                chunk = self._file.read(min(size - len(self._buffer), CHUNK_SIZE))
+                if chunk:
+                    self._buffer += chunk
+                    continue
+                self._file.close()
+                self._file = None
+                continue
+            part = self._parts[self._index]
+            self._index += 1
+            if isinstance(part, bytes):
+                self._buffer += part
+            else:
+                self._file = open(part, 'rb')
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,81 @@
+from settings.paths import image_path
+from settings import settings
+from local.functions import write_log
+from local.media_cache import get_media_cache, content_hash
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Bluesky videos are HLS playlists that ffmpeg turns into an mp4. The conversion is started in the
+# background while the feed is read (start_video) and only waited for when the post is sent (get_video),
+# so a video post doesn't hold up reading the rest of the feed. The playlist url is all a Post carries
+# until then. Converted videos go into the media cache under their playlist url, so retries and later
+# runs don't fetch the playlist again.
+
+_pool = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def is_playlist(url):
+    return bool(url) and ".m3u8" in url
+
+
+def start_video(url):
+    """Starts converting the playlist at url, unless it is cached or already being converted.
+    Returns a future of the local mp4 path (None if the conversion failed)."""
+    global _pool
+    with _lock:
+        future = _pending.get(url)
+        if future is not None:
+            return future
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.video_workers, thread_name_prefix="video")
+        future = _pool.submit(_get_or_convert, url)
+        _pending[url] = future
+    future.add_done_callback(lambda _: _forget(url))
+    return future
+
+
+def get_video(url):
+    """Returns the local mp4 of the playlist at url, waiting for its conversion if needed, or None."""
+    return start_video(url).result()
+
+
+def _forget(url):
+    with _lock:
+        _pending.pop(url, None)
+
+
+def _get_or_convert(url):
+    cache = get_media_cache()
+    path = cache.get(url)
+    if path:
+        write_log(f"Using cached copy of {url}")
+        return path
+    # Named like downloads in progress, so the media cache doesn't evict it while ffmpeg writes to it
+    tmp = os.path.join(image_path, f".download-{threading.get_ident()}-{time.time_ns()}.mp4")
+    started = time.monotonic()
+    try:
+        ffmpeg_command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", url, "-c", "copy", tmp]
+        subprocess.run(ffmpeg_command, check=True, timeout=settings.video_timeout, stdout=subprocess.DEVNULL)
+        if not os.path.exists(tmp):
+            write_log(f"Failed to create output file for {url}.", "error")
+            return None
+        path = cache.add(url, tmp, content_hash(tmp), ".mp4")
+        write_log(f"Successfully downloaded and converted {url} in {time.monotonic() - started:.2f}s.")
+        return path
+    except subprocess.TimeoutExpired:
+        write_log(f"Converting {url} took more than {settings.video_timeout} seconds.", "error")
+        return None
+    except subprocess.CalledProcessError as e:
+        write_log(f"Error during ffmpeg conversion: {e}", "error")
+        return None
+    except FileNotFoundError:
+        write_log("FFmpeg not found. Video processing skipped. Install ffmpeg to enable video support.", "warning")
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from array import array
+from collections.abc import Mapping
+from enum import IntEnum
+from typing import Any, Dict, Iterator, Optional
+
+
+class Destination(IntEnum):
+    TWITTER = 0
+    MASTODON = 1
+    DISCORD = 2
+    TUMBLR = 3
+    BSKY = 4
+    TELEGRAM = 5
+
+    @property
+    def id_key(self) -> str:
+        return self.name.lower() + "_id"
+
+    @property
+    def fail_key(self) -> str:
+        return self.name.lower()
+
+
+ID_KEYS = tuple(d.id_key for d in Destination)
+FAIL_KEYS = tuple(d.fail_key for d in Destination)
+_ID_INDEX = {key: i for i, key in enumerate(ID_KEYS)}
+_FAIL_INDEX = {key: i for i, key in enumerate(FAIL_KEYS)}
+
+# Values used in place of a destination id. Nearly every entry has some of them, so all entries
+# share one copy of each instead of holding their own.
+_SHARED_IDS = {value: value for value in ("", "skipped", "posted", "FailedToPost")}
+
+
+class _FieldView(Mapping):
+    """Dict-like view of an entry's ids or failure counters, for code written against the old dicts."""
+
+    __slots__ = ("_values", "_index", "_keys")
+
+    def __init__(self, values, index, keys):
+        self._values = values
+        self._index = index
+        self._keys = keys
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value):
+        self._values[self._index[key]] = value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class DbEntry:
+    """A database entry: the id a post got on each destination and the failed attempts there.
+
+    Both are fixed-width and indexed by Destination instead of being two dicts with string keys,
+    which keeps large databases small in memory. entry["ids"]["twitter_id"] and
+    entry["failed"]["twitter"] still work for older code.
+    """
+
+    __slots__ = ("_ids", "_failed", "created_at")
+
+    def __init__(self, ids: Optional[Mapping] = None, failed: Optional[Mapping] = None, created_at: int = 0):
+        ids = ids or {}
+        failed = failed or {}
+        self._ids = [_share(ids.get(key) or "") for key in ID_KEYS]
+        self._failed = array("H", (_count(failed.get(key)) for key in FAIL_KEYS))
+        # Unix time the entry was first written, 0 if unknown. Used to archive old entries.
+        self.created_at = int(created_at or 0)
+
+    def get_id(self, destination: Destination) -> str:
+        return self._ids[destination]
+
+    def set_id(self, destination: Destination, value: str):
+        self._ids[destination] = _share(value or "")
+
+    def get_failed(self, destination: Destination) -> int:
+        return self._failed[destination]
+
+    def set_failed(self, destination: Destination, count: int):
+        self._failed[destination] = _count(count)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "ids": dict(zip(ID_KEYS, self._ids)),
+            "failed": dict(zip(FAIL_KEYS, self._failed)),
+        }
+
+    # Dict compatibility
+    def __getitem__(self, key: str):
+        if key == "ids":
+            return _FieldView(self._ids, _ID_INDEX, ID_KEYS)
+        if key == "failed":
+            return _FieldView(self._failed, _FAIL_INDEX, FAIL_KEYS)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ("ids", "failed")
+
+    def __contains__(self, key) -> bool:
+        return key in ("ids", "failed")
+
+    def __eq__(self, other) -> bool:
+        # Entries are equal if their ids and counters are, no matter when they were created.
+        if isinstance(other, DbEntry):
+            return self._ids == other._ids and self._failed == other._failed
+        if isinstance(other, Mapping):
+            return self == DbEntry(other.get("ids"), other.get("failed"))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"DbEntry({self.to_dict()!r})"
+
+
+def _share(value: str) -> str:
+    return _SHARED_IDS.get(value, value)
+
+
+def _count(value) -> int:
+    try:
+        return min(max(int(value or 0), 0), 0xFFFF)
+    except (TypeError, ValueError):
+        return 0
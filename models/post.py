@@ -1,5 +1,5 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, asdict
 from typing import List, Optional, Dict, Any
 import arrow
 
@@ -34,3 +34,18 @@ class Post:
         "tumblr": True,
         "bsky": False,
     })
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Json-safe copy of the post, for storing it (see from_dict)."""
+        data = asdict(self)
+        if isinstance(self.created_at, arrow.Arrow):
+            data["created_at"] = self.created_at.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Post":
+        data = dict(data)
+        data["media"] = [Media(**m) for m in data.get("media") or []]
+        if data.get("created_at"):
+            data["created_at"] = arrow.get(data["created_at"])
+        return cls(**data)
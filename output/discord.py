@@ -1,7 +1,14 @@
+import json
+import os
 import requests
 from settings import settings
 from settings.auth import DISCORD_WEBHOOK_URL
 from local.functions import write_log
+from local.upload import MultipartStream
+
+MAX_ATTACHMENTS = 10
+# Webhook messages can carry at most this many bytes of files (more on boosted servers)
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
 
 
 def post_to_discord(content, link, images=None, username="lynx-todon-otron", avatar_url=None, bluesky_link=None):
@@ -26,7 +33,30 @@ def post_to_discord(content, link, images=None, username="lynx-todon-otron", ava
     if avatar_url:
         data["avatar_url"] = avatar_url
 
-    response = requests.post(DISCORD_WEBHOOK_URL, data=data)
+    attachments = []
+    size = 0
+    for path in (images or [])[:MAX_ATTACHMENTS]:
+        # Files that don't fit are left out, the post is still linked
+        if size + os.path.getsize(path) > MAX_UPLOAD_BYTES:
+            write_log(f"Not attaching {path} to Discord, it is over the upload limit.", "warning")
+            continue
+        size += os.path.getsize(path)
+        attachments.append(path)
+
+    response = None
+    if attachments:
+        # Attached as files[0], files[1]..., streamed from disk
+        files = {f"files[{i}]": path for i, path in enumerate(attachments)}
+        body = MultipartStream({"payload_json": json.dumps(data)}, files)
+        try:
+            response = requests.post(DISCORD_WEBHOOK_URL, data=body, headers={"Content-Type": body.content_type})
+        finally:
+            body.close()
+        if response.status_code == 413:
+            write_log("Discord refused the attachments as too large, posting without them.", "warning")
+            response = None
+    if response is None:
+        response = requests.post(DISCORD_WEBHOOK_URL, data=data)
 
     if response.status_code < 300:
         write_log("Posted to Discord successfully")
@@ -2,7 +2,10 @@ from mastodon import Mastodon
 from settings import settings
 from settings.auth import *
 from local.functions import write_log
+from local.media_ids import remote_media_id, remember_media_id, forget_media_ids
+from models.entry import Destination
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 mastodon_client = None
 
@@ -35,32 +38,55 @@ def toot(post, reply_to_post, quoted_post, images, visibility = "unlisted"):
         raise Exception("Mastodon client not initialized")
 
     media_ids = []
-    # If post includes images, images are uploaded so that they can be included in the toot
+    # If post includes images, images are uploaded so that they can be included in the toot. They are all
+    # uploaded at once, and all of them have to be processed by the server within mastodon_media_timeout.
     if images:
-        for image in images:
-            filename = image["filename"]
-            alt = image["alt"]
-            # If alt text was added to the image on bluesky, it's also added to the image on mastodon,
-            # otherwise it will be uploaded without alt text.
-            if alt:
-                write_log("Uploading image " + filename + " with alt: " + alt + " to mastodon")
-                res = mastodon.media_post(filename, description=alt)
-            else:
-                write_log("Uploading image " + filename)
-                res = mastodon.media_post(filename)
-            #wait for file to be processed
-            while not "url" in res or res.url is None:
-                res = mastodon.media(res)
-                time.sleep(10)
-            media_ids.append(res.id)
+        deadline = time.monotonic() + settings.mastodon_media_timeout
+        with ThreadPoolExecutor(max_workers=min(len(images), 4)) as pool:
+            media_ids = list(pool.map(lambda image: upload_media(mastodon, image, deadline), images))
     # I wanted to make this part a little neater, but didn't get it to work and gave up. So here we are.
     # If post is both reply and has images it is posted as both a reply and with images (duh). 
     # If just either of the two it is posted as with just that, and if neither it is just posted as a text post.
     a = mastodon.status_post(post, in_reply_to_id=reply_to_post, media_ids=media_ids, visibility=visibility)
+    # Attached media can't be attached to another status
+    if images:
+        forget_media_ids(Destination.MASTODON, [image["filename"] for image in images])
     write_log("Posted to mastodon")
     id = a["id"]
     return id
 
+def upload_media(mastodon, image, deadline):
+    filename = image["filename"]
+    alt = image["alt"]
+    # Media uploaded before a failed attempt is still unattached and can be used again
+    media_id = remote_media_id(Destination.MASTODON, filename, alt)
+    if media_id:
+        write_log("Reusing image " + filename + " already uploaded to mastodon")
+        return media_id
+    # If alt text was added to the image on bluesky, it's also added to the image on mastodon,
+    # otherwise it will be uploaded without alt text.
+    if alt:
+        write_log("Uploading image " + filename + " with alt: " + alt + " to mastodon")
+        res = mastodon.media_post(filename, description=alt)
+    else:
+        write_log("Uploading image " + filename)
+        res = mastodon.media_post(filename)
+    res = wait_for_processing(mastodon, res, deadline)
+    remember_media_id(Destination.MASTODON, filename, res.id, alt)
+    return res.id
+
+# Waits for the server to finish processing an upload. Checked often at first and then less often, as
+# images are usually done within a second while videos can take minutes.
+def wait_for_processing(mastodon, res, deadline):
+    delay = 0.5
+    while not "url" in res or res.url is None:
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Mastodon did not finish processing media {res.id} in time")
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+        res = mastodon.media(res)
+    return res
+
 def retoot(toot_id):
     mastodon = get_mastodon()
     if not mastodon:
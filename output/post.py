@@ -1,54 +1,64 @@
-import random
-import string
 import time
-import urllib.request
 import arrow
-import requests
 import re
+import threading
 from typing import Dict, Tuple, Any
 
 from settings import settings
-from settings.paths import image_path
 from local.functions import write_log
-from local.db import db_write
+from local.media_cache import get_media_cache
+from local.video import is_playlist, start_video, get_video
+from local.media_prep import prepare_media
+from local.upload import file_chunks, mime_type
+from local.db import db_write, db_lookup, db_update
+from local.jobs import get_job_queue, backoff
+from local.breaker import get_breaker, BreakerOpen
+from local.media_ids import remote_media_id, remember_media_id
 from output.twitter import tweet, retweet
 from output.mastodon import toot, retoot
 from output.discord import post_to_discord
 from output.tumblr import post_to_tumblr
 from output.telegram import post_to_telegram
-from atproto import Client, models as atp
-from input.bluesky import load_session_string
+from atproto import models as atp
+from atproto_client.models.blob_ref import BlobRef
+from atproto_client.models.utils import get_response_model
+from input.bluesky import get_bsky_session, resolve_handles
 from datetime import datetime
 from models.post import Post, Media
+from models.entry import Destination, DbEntry
 from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from output.scheduler import schedule_posts
 
 def download_image(image_url):
     try:
-        filename = ''.join(random.choice(string.ascii_lowercase) for i in range(10)) + ".jpg"
-        filepath = image_path + filename
-        urllib.request.urlretrieve(image_url, filepath)
-        return filepath
+        return get_media_cache().fetch(image_url)
     except Exception as e:
         write_log(f"Failed to download image: {e}", "error")
         return None
 
 def get_images(media_list: list[Media]) -> list[Dict[str, str]]:
     """Ensures all media is downloaded locally."""
+    # Everything that needs a download (unless it is in the media cache) is downloaded at once
+    missing = [m for m in media_list if m.url and not (m.filename and os.path.exists(m.filename))]
+    videos = [m for m in missing if is_playlist(m.url)]
+    missing = [m for m in missing if not is_playlist(m.url)]
+    for m in videos:
+        # Started when the batch was scheduled, often done by now
+        m.filename = get_video(m.url)
+        if not m.filename:
+            write_log(f"Failed to download or convert {m.url} to mp4.", "error")
+    for m, filepath in zip(missing, get_media_cache().fetch_all([(m.url, ".jpg") for m in missing])):
+        if filepath:
+            # Update the object itself to avoid re-downloading later if needed
+            m.filename = filepath
+
     local_images = []
     for m in media_list:
-        if m.filename:
+        if m.filename and os.path.exists(m.filename):
             local_images.append({"filename": m.filename, "alt": m.alt})
-        else:
-            # needs download
-            filename = ''.join(random.choice(string.ascii_lowercase) for i in range(10)) + ".jpg"
-            filepath = image_path + filename
-            try:
-                urllib.request.urlretrieve(m.url, filepath)
-                # Update the object itself to avoid re-downloading later if needed
-                m.filename = filepath
-                local_images.append({"filename": filepath, "alt": m.alt})
-            except Exception as e:
-                write_log(f"Failed to download image {m.url}: {e}", "error")
+        elif not m.url:
+            write_log(f"Media file {m.filename} no longer exists", "error")
     return local_images
 
 def extract_hashtags(text):
@@ -81,15 +91,11 @@ def parse_urls(text):
 
 def build_typed_facets(text: str):
     facets: list[atp.AppBskyRichtextFacet.Main] = []
-    # Mentions
-    for m in parse_mentions(text):
-        resp = requests.get(
-            "https://bsky.social/xrpc/com.atproto.identity.resolveHandle",
-            params={"handle": m["handle"]},
-        )
-        if resp.status_code == 400:
-            continue
-        did = resp.json().get("did")
+    # Mentions, all handles resolved at once
+    mentions = parse_mentions(text)
+    dids = resolve_handles([m["handle"].lstrip("@") for m in mentions]) if mentions else {}
+    for m in mentions:
+        did = dids.get(m["handle"].lstrip("@").lower())
         if not did:
             continue
         facets.append(
@@ -119,47 +125,49 @@ def build_typed_facets(text: str):
             )
     return facets or None
 
-def post_to_bluesky(text, images: list[Dict[str, str]]):
-    session_string = load_session_string()
-    client = Client()
+def upload_bsky_blob(client, filename):
+    """Uploads a file as a blob, or returns the blob it got when it was uploaded shortly before."""
+    cached = remote_media_id(Destination.BSKY, filename)
+    if cached:
+        write_log(f"Reusing {filename} already uploaded to Bluesky")
+        return BlobRef.model_validate(cached)
+    # Streamed from disk instead of reading the whole file (a video can be tens of MB) into memory
+    response = client.invoke_procedure(
+        'com.atproto.repo.uploadBlob',
+        content=file_chunks(filename),
+        headers={'Content-Type': mime_type(filename), 'Content-Length': str(os.path.getsize(filename))},
+        output_encoding='application/json',
+    )
+    up = get_response_model(response, atp.ComAtprotoRepoUploadBlob.Response)
+    remember_media_id(Destination.BSKY, filename, up.blob.model_dump(by_alias=True, mode='json'))
+    return up.blob
+
+# Repo DID and handle of the logged in Bluesky account, looked up once.
+_bsky_repo = None
+
+def get_bsky_repo(client):
+    global _bsky_repo
+    if _bsky_repo is None:
+        me = getattr(client, 'me', None)
+        if me is not None and getattr(me, 'did', None):
+            _bsky_repo = (me.did, getattr(me, 'handle', None))
+        else:
+            sess = client.com.atproto.server.get_session()
+            _bsky_repo = (sess.did, getattr(sess, 'handle', None))
+    return _bsky_repo
 
-    if not session_string:
-        write_log("BSKY_SESSION_STRING is not set. Cannot login to Bluesky.", "error")
+def post_to_bluesky(text, images: list[Dict[str, str]]):
+    # The client from input.bluesky stays logged in between posts (and runs)
+    try:
+        client = get_bsky_session()
+    except Exception as login_err:
+        write_log(f"Failed to login to Bluesky: {login_err}", "error")
         return False, None
-    # Try session string first
+
     try:
-        client.login(session_string=session_string)
+        repo, handle = get_bsky_repo(client)
     except Exception as e:
-        write_log(f"Session login failed ({e}), attempting password login...", "warning")
-        try:
-             from settings.auth import BSKY_HANDLE, BSKY_PASSWORD
-             client.login(BSKY_HANDLE, BSKY_PASSWORD)
-             # Update stored session string
-             if hasattr(client, 'export_session_string'):
-                  new_session = client.export_session_string()
-                  with open("session.txt", "w") as f:
-                      f.write(new_session)
-        except Exception as login_err:
-             write_log(f"Failed to login to Bluesky with password: {login_err}", "error")
-             return False, None
-
-    # Determine repo DID from session
-    try:
-        sess = client.com.atproto.server.get_session()
-        repo = sess.did
-        handle = getattr(sess, 'handle', None)
-    except Exception:
-        repo = None
-        handle = None
-
-    if not repo and handle:
-        try:
-            r = client.com.atproto.identity.resolve_handle(params={"handle": handle})
-            repo = getattr(r, 'did', None)
-        except Exception:
-            pass
-    if not repo:
-        write_log("Unable to determine repo DID for Bluesky account.", "error")
+        write_log(f"Unable to determine repo DID for Bluesky account: {e}", "error")
         return False, None
 
     typed_facets = build_typed_facets(text)
@@ -169,22 +177,16 @@ def post_to_bluesky(text, images: list[Dict[str, str]]):
         if images:
             if len(images) == 1 and images[0]["filename"].endswith(".mp4"):
                 # Attempt video embed
-                with open(images[0]["filename"], 'rb') as f:
-                    video_bytes = f.read()
-                up = client.com.atproto.repo.upload_blob(video_bytes)
                 embed = atp.AppBskyEmbedVideo.Main(
-                    video=up.blob,
+                    video=upload_bsky_blob(client, images[0]["filename"]),
                     alt=images[0].get("alt", ""),
                 )
             else:
                 imgs: list[atp.AppBskyEmbedImages.Image] = []
                 for im in images:
-                    with open(im["filename"], 'rb') as f:
-                        img_bytes = f.read()
-                    up = client.com.atproto.repo.upload_blob(img_bytes)
                     imgs.append(
                         atp.AppBskyEmbedImages.Image(
-                            image=up.blob,
+                            image=upload_bsky_blob(client, im["filename"]),
                             alt=im.get("alt", ""),
                         )
                     )
@@ -209,9 +211,8 @@ def post_to_bluesky(text, images: list[Dict[str, str]]):
             )
         )
         write_log("Bluesky post created.")
-        time.sleep(2)
         post_rkey = create.uri.split('/')[-1]
-        profile = handle or getattr(sess, 'handle', None)
+        profile = handle
         bluesky_link = f"https://bsky.app/profile/{profile or 'self'}/post/{post_rkey}"
         return True, bluesky_link
     except Exception as e:
@@ -244,8 +245,34 @@ def save_dry_run_receipts(receipts):
     with open(DRY_RUN_FILE, 'w') as f:
         json.dump(existing, f, indent=2)
 
+_destination_pool = None
+
+
+def get_destination_pool():
+    global _destination_pool
+    if _destination_pool is None:
+        _destination_pool = ThreadPoolExecutor(max_workers=settings.destination_workers,
+                                               thread_name_prefix="destination")
+    return _destination_pool
+
+
+# Sends a post to every destination. With destination_workers above 1 they are all sent to at the same
+# time, so a post takes about as long as the slowest destination instead of all of them added up.
+def send_to_destinations(senders):
+    if settings.destination_workers <= 1:
+        for sender in senders:
+            sender()
+        return
+    futures = [get_destination_pool().submit(sender) for sender in senders]
+    for future in futures:
+        try:
+            future.result()
+        except Exception as error:
+            write_log(error, "error")
+
 # Updating the post function to use the mocking logic
-def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str, Any]):
+def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str, Any], only: Destination = None):
+    # only is set when retrying a queued job, the post is then only sent to that destination.
     updates = False
     dry_run_receipts = []
 
@@ -278,15 +305,27 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
     # Let's assume accumulation for the batch, but we need a way to clear it. 
     # Implementation plan said "Update /api/run to clear previous". So we assume it's cleared there.
 
-    for cid in reversed(list(posts.keys())):
+    # Ids of the posts in this batch that are done, so their replies and quotes can be threaded to them
+    # even when they are not written to the database (test mode).
+    landed = {}
+    # Posts that are still being sent count against max_per_hour too (see send_post).
+    in_flight = set()
+    hour_lock = threading.Lock()
+
+    def start_post(cid):
+        try:
+            # False once max_per_hour is reached, which stops the batch
+            return send_post(cid)
+        finally:
+            with hour_lock:
+                in_flight.discard(cid)
+
+    def send_post(cid):
+        nonlocal database, updates
         post_obj = posts[cid]
         
         # ... (existing setup code for variables) ...
         # We need to replicate the variable setup to properly mock
-        
-        if settings.max_per_hour != 0 and len(post_cache) >= settings.max_per_hour:
-             write_log("Max posts per hour reached.")
-             break
 
         posted = False
         tweet_id = ""
@@ -302,19 +341,20 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
         bsky_fail = 0
         te_fail = 0
         
-        if cid in database and not settings.TEST_MODE:
-            tweet_id = database[cid]["ids"]["twitter_id"]
-            toot_id = database[cid]["ids"]["mastodon_id"]
-            discord_id = database[cid]["ids"]["discord_id"]
-            tumblr_id = database[cid]["ids"]["tumblr_id"]
-            bsky_id = database[cid]["ids"].get("bsky_id", "")
-            telegram_id = database[cid]["ids"].get("telegram_id", "")
-            t_fail = database[cid]["failed"]["twitter"]
-            m_fail = database[cid]["failed"]["mastodon"]
-            d_fail = database[cid]["failed"]["discord"]
-            tu_fail = database[cid]["failed"]["tumblr"]
-            bsky_fail = database[cid]["failed"].get("bsky", 0)
-            te_fail = database[cid]["failed"].get("telegram", 0)
+        entry = db_lookup(database, cid)
+        if entry and not settings.TEST_MODE:
+            tweet_id = entry.get_id(Destination.TWITTER)
+            toot_id = entry.get_id(Destination.MASTODON)
+            discord_id = entry.get_id(Destination.DISCORD)
+            tumblr_id = entry.get_id(Destination.TUMBLR)
+            bsky_id = entry.get_id(Destination.BSKY)
+            telegram_id = entry.get_id(Destination.TELEGRAM)
+            t_fail = entry.get_failed(Destination.TWITTER)
+            m_fail = entry.get_failed(Destination.MASTODON)
+            d_fail = entry.get_failed(Destination.DISCORD)
+            tu_fail = entry.get_failed(Destination.TUMBLR)
+            bsky_fail = entry.get_failed(Destination.BSKY)
+            te_fail = entry.get_failed(Destination.TELEGRAM)
 
         # Fail-safties (omitted for brevity in this thought, but needed in code)
         # We'll just assume we are replacing the loop body or injecting the check.
@@ -338,7 +378,6 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
         quoted_post = post_obj.quoted_id
         quote_url = post_obj.quote_url
         link = post_obj.link
-        image_dicts = get_images(post_obj.media)
         visibility = post_obj.visibility
         allowed_reply = post_obj.allowed_reply
         repost = post_obj.repost
@@ -355,22 +394,26 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
         if cid in post_cache:
             repost_timelimit = post_cache[cid]
 
-        if reply_to_post in database:
-            tweet_reply = database[reply_to_post]["ids"]["twitter_id"]
-            toot_reply = database[reply_to_post]["ids"]["mastodon_id"]
-        elif reply_to_post and reply_to_post not in database:
+        # Parents older than db_retention_days are looked up in the archive
+        reply_entry = landed.get(reply_to_post) or db_lookup(database, reply_to_post)
+        quote_entry = landed.get(quoted_post) or db_lookup(database, quoted_post)
+
+        if reply_entry:
+            tweet_reply = reply_entry.get_id(Destination.TWITTER)
+            toot_reply = reply_entry.get_id(Destination.MASTODON)
+        elif reply_to_post:
              write_log(f"Post {cid} was a reply to a post that is not in the database.", "error")
-             continue
+             return
 
-        if quoted_post in database:
-             tweet_quote = database[quoted_post]["ids"]["twitter_id"]
-             toot_quote = database[quoted_post]["ids"]["mastodon_id"]
-        elif quoted_post and quoted_post not in database:
+        if quote_entry:
+             tweet_quote = quote_entry.get_id(Destination.TWITTER)
+             toot_quote = quote_entry.get_id(Destination.MASTODON)
+        elif quoted_post:
              if settings.quote_posts and quote_url not in text:
                  text += "\n" + quote_url
              elif not settings.quote_posts:
                  write_log(f"Post {cid} was a quote of a post that is not in the database.", "error")
-                 continue
+                 return
 
         if not tweet_reply: tweet_reply = None
         if not toot_reply: toot_reply = None
@@ -384,187 +427,276 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
         do_telegram = post_obj.post_to.get("telegram", True)
 
         if tweet_id and toot_id and discord_id and tumblr_id and bsky_id and telegram_id and not repost:
-            continue
+            return
+
+        # Only posts that are actually sent count against the limit
+        with hour_lock:
+            if settings.max_per_hour != 0 and len(post_cache) + len(in_flight) >= settings.max_per_hour:
+                write_log("Max posts per hour reached.")
+                return False
+            in_flight.add(cid)
+
+        image_dicts = get_images(post_obj.media)
+
+        # Destinations with a queued retry are left to the job queue
+        queued = get_job_queue().queued(cid) if only is None and not settings.TEST_MODE else set()
+
+        def wanted(destination):
+            if only is not None:
+                return destination == only
+            if destination in queued:
+                write_log(f"Post {cid} is queued for another attempt at {destination.name.lower()}.")
+                return False
+            return True
+
+        # Every destination gets copies of the images that fit its limits where needed (not in test mode,
+        # which doesn't send anything)
+        enabled = {Destination.TWITTER: do_twitter, Destination.MASTODON: do_mastodon,
+                   Destination.DISCORD: do_discord, Destination.TUMBLR: do_tumblr,
+                   Destination.BSKY: do_bsky, Destination.TELEGRAM: do_telegram}
+        media_for = prepare_media(image_dicts, [] if settings.TEST_MODE else [
+            destination for destination, on in enabled.items() if on and (only is None or destination == only)])
 
         if settings.TEST_MODE:
              record_receipt("Dry Run Preview", text, image_dicts, post_obj)
              # We rely on this to show output even if all services are disabled.
 
 
+        fails_before = {Destination.TWITTER: t_fail, Destination.MASTODON: m_fail, Destination.DISCORD: d_fail,
+                        Destination.TUMBLR: tu_fail, Destination.BSKY: bsky_fail, Destination.TELEGRAM: te_fail}
+        # Destinations skipped because their circuit breaker is open. That doesn't count as a failed attempt.
+        held = set()
+
+        def queue_retries(fails_after):
+            # A failed first attempt is retried from the job queue from now on, a destination that is down
+            # once its breaker lets posts through again.
+            if only is not None or settings.TEST_MODE:
+                return
+            for destination, failed in fails_after.items():
+                if destination in held:
+                    get_job_queue().enqueue(post_obj, destination, failed, at=get_breaker(destination).next_trial_at)
+                elif failed > fails_before[destination]:
+                    get_job_queue().enqueue(post_obj, destination, failed)
+
         # Post to Bluesky
         if do_bsky:
             if bsky_id:
                 write_log(f"Post {cid} already posted to Bluesky.")
-            else:
+            elif wanted(Destination.BSKY):
                 if settings.TEST_MODE:
                      bsky_id = "DRY_RUN_BSKY_ID"
-                     record_receipt("Bluesky", text, image_dicts, post_obj)
+                     record_receipt("Bluesky", text, media_for[Destination.BSKY], post_obj)
                      updates = True
                      post_obj.link = "http://dryrun.local/bsky/123"
                      post_cache[cid] = arrow.utcnow()
                 else: 
-                    success, bsky_link = post_to_bluesky(text, image_dicts)
-                    if success:
-                        updates = True
-                        bsky_id = bsky_link.split('/')[-1]
-                        post_obj.link = bsky_link
-                        post_cache[cid] = arrow.utcnow()
+                    try:
+                        success, bsky_link = get_breaker(Destination.BSKY).call(
+                            post_to_bluesky, text, media_for[Destination.BSKY], succeeded=lambda result: result[0])
+                    except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.BSKY)
                     else:
-                        bsky_fail += 1
-                        bsky_id = ""
+                        if success:
+                            updates = True
+                            bsky_id = bsky_link.split('/')[-1]
+                            post_obj.link = bsky_link
+                            post_cache[cid] = arrow.utcnow()
+                        else:
+                            bsky_fail += 1
+                            bsky_id = ""
+            queue_retries({Destination.BSKY: bsky_fail})
             if post_obj.source == 'instagram':
                  database = db_write(cid, tweet_id, toot_id, discord_id, tumblr_id, bsky_id, telegram_id,
                             {"twitter": t_fail, "mastodon": m_fail, "discord": d_fail, "tumblr": tu_fail,
                              "bsky": bsky_fail, "telegram": te_fail}, database)
-                 continue
+                 return
 
+        # Each destination only touches its own id and fail counter (and sets posted/updates), so
+        # they can be sent to at the same time. See send_to_destinations().
         # Post to Twitter
-        if not do_twitter:
-             tweet_id = "skipped"
-             write_log("Not posting to Twitter because posting was set to false.")
-        elif tweet_id and not repost:
-             write_log("Post " + cid + " already sent to Twitter.")
-        elif tweet_id and repost and timestamp > repost_timelimit:
-             # Repost logic
-             if settings.TEST_MODE:
-                 write_log(f"[DRY RUN] Would Retweet {tweet_id}")
-                 posted = True
-             else:
-                 try:
-                    retweet(tweet_id)
-                    posted = True
-                 except Exception as error:
-                    write_log(error, "error")
-        elif not tweet_id and tweet_reply != "skipped" and tweet_reply != "FailedToPost":
-             updates = True
-             if settings.TEST_MODE:
-                 tweet_id = "DRY_RUN_TWITTER_ID"
-                 record_receipt("Twitter", text, image_dicts, post_obj)
-                 posted = True
-             else:
-                 try:
-                    tweet_id = tweet(text, tweet_reply, tweet_quote, image_dicts, allowed_reply)
-                    posted = True
-                 except Exception as error:
-                    write_log(error, "error")
-                    t_fail += 1
-                    tweet_id = ""
-        else:
-             write_log("Not posting " + cid + " to Twitter")
-        
-        # Post to Mastodon
-        if not do_mastodon:
-             toot_id = "skipped"
-             write_log("Not posting to Mastodon because posting was set to false.")
-        elif toot_id and not repost:
-            write_log("Post " + cid + " already sent to Mastodon.")
-        elif toot_id and repost and timestamp > repost_timelimit:
-            if settings.TEST_MODE:
-                write_log(f"[DRY RUN] Would Retoot {toot_id}")
-                posted = True
+        def send_twitter():
+            nonlocal tweet_id, t_fail, posted, updates
+            if not do_twitter:
+                 tweet_id = "skipped"
+                 write_log("Not posting to Twitter because posting was set to false.")
+            elif tweet_id and not repost:
+                 write_log("Post " + cid + " already sent to Twitter.")
+            elif tweet_id and repost and timestamp > repost_timelimit:
+                 # Repost logic
+                 if settings.TEST_MODE:
+                     write_log(f"[DRY RUN] Would Retweet {tweet_id}")
+                     posted = True
+                 else:
+                     try:
+                        retweet(tweet_id)
+                        posted = True
+                     except Exception as error:
+                        write_log(error, "error")
+            elif not tweet_id and tweet_reply != "skipped" and tweet_reply != "FailedToPost":
+                 updates = True
+                 if settings.TEST_MODE:
+                     tweet_id = "DRY_RUN_TWITTER_ID"
+                     record_receipt("Twitter", text, media_for[Destination.TWITTER], post_obj)
+                     posted = True
+                 else:
+                     try:
+                        tweet_id = get_breaker(Destination.TWITTER).call(
+                            tweet, text, tweet_reply, tweet_quote, media_for[Destination.TWITTER], allowed_reply)
+                        posted = True
+                     except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.TWITTER)
+                     except Exception as error:
+                        write_log(error, "error")
+                        t_fail += 1
+                        tweet_id = ""
             else:
-                try:
-                    retoot(toot_id)
-                    posted = True
-                except Exception as error:
-                    write_log(error, "error")
-        elif not toot_id and toot_reply != "skipped" and toot_reply != "FailedToPost":
-            updates = True
-            if settings.TEST_MODE:
-                 toot_id = "DRY_RUN_MASTODON_ID"
-                 record_receipt("Mastodon", text, image_dicts, post_obj)
-                 posted = True
-            else:
-                try:
-                    toot_id = toot(text, toot_reply, toot_quote, image_dicts, visibility)
+                 write_log("Not posting " + cid + " to Twitter")
+
+        # Post to Mastodon
+        def send_mastodon():
+            nonlocal toot_id, m_fail, posted, updates
+            if not do_mastodon:
+                 toot_id = "skipped"
+                 write_log("Not posting to Mastodon because posting was set to false.")
+            elif toot_id and not repost:
+                write_log("Post " + cid + " already sent to Mastodon.")
+            elif toot_id and repost and timestamp > repost_timelimit:
+                if settings.TEST_MODE:
+                    write_log(f"[DRY RUN] Would Retoot {toot_id}")
                     posted = True
-                except Exception as error:
-                    write_log(error, "error")
-                    m_fail += 1
-                    toot_id = ""
-            if not posted and not toot_id: # matching original logic structure? 
-                write_log("Not posting " + cid + " to Mastodon")
+                else:
+                    try:
+                        retoot(toot_id)
+                        posted = True
+                    except Exception as error:
+                        write_log(error, "error")
+            elif not toot_id and toot_reply != "skipped" and toot_reply != "FailedToPost":
+                updates = True
+                if settings.TEST_MODE:
+                     toot_id = "DRY_RUN_MASTODON_ID"
+                     record_receipt("Mastodon", text, media_for[Destination.MASTODON], post_obj)
+                     posted = True
+                else:
+                    try:
+                        toot_id = get_breaker(Destination.MASTODON).call(
+                            toot, text, toot_reply, toot_quote, media_for[Destination.MASTODON], visibility)
+                        posted = True
+                    except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.MASTODON)
+                    except Exception as error:
+                        write_log(error, "error")
+                        m_fail += 1
+                        toot_id = ""
+                if not posted and not toot_id: # matching original logic structure? 
+                    write_log("Not posting " + cid + " to Mastodon")
 
         # Post to Discord
-        if not do_discord:
-            discord_id = "skipped"
-            write_log("Not posting to Discord because posting was set to false.")
-        elif discord_id and not repost:
-            write_log("Post " + cid + " already sent to Discord.")
-        elif discord_id and repost and timestamp > repost_timelimit:
-            pass
-        elif not discord_id and toot_reply != "skipped" and toot_reply != "FailedToPost":
-            updates = True
-            if settings.TEST_MODE:
-                 discord_id = "DRY_RUN_DISCORD_ID"
-                 record_receipt("Discord", text, image_dicts, post_obj)
-                 posted = True
+        def send_discord():
+            nonlocal discord_id, d_fail, posted, updates
+            if not do_discord:
+                discord_id = "skipped"
+                write_log("Not posting to Discord because posting was set to false.")
+            elif discord_id and not repost:
+                write_log("Post " + cid + " already sent to Discord.")
+            elif discord_id and repost and timestamp > repost_timelimit:
+                pass
+            elif not discord_id and toot_reply != "skipped" and toot_reply != "FailedToPost":
+                updates = True
+                if settings.TEST_MODE:
+                     discord_id = "DRY_RUN_DISCORD_ID"
+                     record_receipt("Discord", text, media_for[Destination.DISCORD], post_obj)
+                     posted = True
+                else:
+                    try:
+                        fnames = [img['filename'] for img in media_for[Destination.DISCORD]]
+                        get_breaker(Destination.DISCORD).call(post_to_discord, text, link, fnames)
+                        discord_id = "posted"
+                        posted = True
+                    except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.DISCORD)
+                    except Exception as error:
+                        write_log(error, "error")
+                        d_fail += 1
+                        discord_id = ""
             else:
-                try:
-                    fnames = [img['filename'] for img in image_dicts]
-                    post_to_discord(text, link, fnames)
-                    discord_id = "posted"
-                    posted = True
-                except Exception as error:
-                    write_log(error, "error")
-                    d_fail += 1
-                    discord_id = ""
-        else:
-            write_log("Not posting " + cid + " to Discord")
+                write_log("Not posting " + cid + " to Discord")
 
         # Post to Tumblr
-        if not do_tumblr:
-            tumblr_id = "skipped"
-            write_log("Not posting to Tumblr because posting was set to false.")
-        elif tumblr_id and not repost:
-            write_log(f"Post {cid} already sent to Tumblr.")
-        elif tumblr_id and repost and timestamp > repost_timelimit:
-            pass
-        elif not tumblr_id:
-            updates = True
-            if settings.TEST_MODE:
-                 tumblr_id = "DRY_RUN_TUMBLR_ID"
-                 record_receipt("Tumblr", text, image_dicts, post_obj)
-                 posted = True
+        def send_tumblr():
+            nonlocal tumblr_id, tu_fail, posted, updates
+            if not do_tumblr:
+                tumblr_id = "skipped"
+                write_log("Not posting to Tumblr because posting was set to false.")
+            elif tumblr_id and not repost:
+                write_log(f"Post {cid} already sent to Tumblr.")
+            elif tumblr_id and repost and timestamp > repost_timelimit:
+                pass
+            elif not tumblr_id:
+                updates = True
+                if settings.TEST_MODE:
+                     tumblr_id = "DRY_RUN_TUMBLR_ID"
+                     record_receipt("Tumblr", text, media_for[Destination.TUMBLR], post_obj)
+                     posted = True
+                else:
+                    try:
+                        tumblr_id = get_breaker(Destination.TUMBLR).call(post_to_tumblr, text, media_for[Destination.TUMBLR])
+                        posted = True
+                    except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.TUMBLR)
+                    except Exception as error:
+                        write_log(error, "error")
+                        tu_fail += 1
+                        tumblr_id = ""
             else:
-                try:
-                    tumblr_id = post_to_tumblr(text, image_dicts)
-                    posted = True
-                except Exception as error:
-                    write_log(error, "error")
-                    tu_fail += 1
-                    tumblr_id = ""
-        else:
-            write_log(f"Not posting {cid} to Tumblr")
+                write_log(f"Not posting {cid} to Tumblr")
 
         # Post to Telegram
-        if not do_telegram:
-            telegram_id = "skipped"
-            write_log("Not posting to Telegram because posting was set to false.")
-        elif telegram_id and not repost:
-            write_log(f"Post {cid} already sent to Telegram.")
-        elif telegram_id and repost and timestamp > repost_timelimit:
-            pass
-        elif not telegram_id:
-            updates = True
-            if settings.TEST_MODE:
-                 telegram_id = "DRY_RUN_TELEGRAM_ID"
-                 record_receipt("Telegram", text, image_dicts, post_obj)
-                 posted = True
-            else:
-                try:
-                    # Pass link as Arg 2, and None for Arg 4 to avoid duplication since link is the source
-                    res = post_to_telegram(text, link, image_dicts, None)
-                    if res:
-                         telegram_id = res
-                         posted = True
-                    else:
-                         te_fail += 1
-                         telegram_id = ""
-                except Exception as error:
-                    write_log(error, "error")
-                    te_fail += 1
-                    telegram_id = ""
+        def send_telegram():
+            nonlocal telegram_id, te_fail, posted, updates
+            if not do_telegram:
+                telegram_id = "skipped"
+                write_log("Not posting to Telegram because posting was set to false.")
+            elif telegram_id and not repost:
+                write_log(f"Post {cid} already sent to Telegram.")
+            elif telegram_id and repost and timestamp > repost_timelimit:
+                pass
+            elif not telegram_id:
+                updates = True
+                if settings.TEST_MODE:
+                     telegram_id = "DRY_RUN_TELEGRAM_ID"
+                     record_receipt("Telegram", text, media_for[Destination.TELEGRAM], post_obj)
+                     posted = True
+                else:
+                    try:
+                        # Pass link as Arg 2, and None for Arg 4 to avoid duplication since link is the source
+                        res = get_breaker(Destination.TELEGRAM).call(
+                            post_to_telegram, text, link, media_for[Destination.TELEGRAM], None, succeeded=bool)
+                        if res:
+                             telegram_id = res
+                             posted = True
+                        else:
+                             te_fail += 1
+                             telegram_id = ""
+                    except BreakerOpen as error:
+                        write_log(error, "warning")
+                        held.add(Destination.TELEGRAM)
+                    except Exception as error:
+                        write_log(error, "error")
+                        te_fail += 1
+                        telegram_id = ""
+
+        senders = {Destination.TWITTER: send_twitter, Destination.MASTODON: send_mastodon,
+                   Destination.DISCORD: send_discord, Destination.TUMBLR: send_tumblr,
+                   Destination.TELEGRAM: send_telegram}
+        send_to_destinations([sender for destination, sender in senders.items() if wanted(destination)])
+
+        queue_retries({Destination.TWITTER: t_fail, Destination.MASTODON: m_fail, Destination.DISCORD: d_fail,
+                       Destination.TUMBLR: tu_fail, Destination.TELEGRAM: te_fail})
 
         # Update DB - In Dry Run, we probably want to NOT update the DB?
         # If we update the DB with "DRY_RUN_ID", subsequent real runs will think it's posted.
@@ -576,8 +708,55 @@ def post(posts: Dict[str, Post], database: Dict[str, Any], post_cache: Dict[str,
                              "bsky": bsky_fail, "telegram": te_fail}, database)
             if posted:
                 post_cache[cid] = arrow.utcnow()
+        landed[cid] = DbEntry({"twitter_id": tweet_id, "mastodon_id": toot_id})
+
+    # Oldest first; replies and quotes wait for their parent if it is in the batch.
+    # Videos of posts that still have somewhere to go are converted in the background while the batch is
+    # sent. Posts that are already crossposted everywhere don't need theirs.
+    for cid, post_obj in posts.items():
+        entry = None if settings.TEST_MODE else db_lookup(database, cid)
+        if entry and not post_obj.repost and all(entry.get_id(destination) for destination in Destination):
+            continue
+        for media in post_obj.media:
+            if is_playlist(media.url) and not (media.filename and os.path.exists(media.filename)):
+                start_video(media.url)
+
+    schedule_posts(posts, start_post, list(reversed(list(posts.keys()))))
     
     if settings.TEST_MODE and dry_run_receipts:
         save_dry_run_receipts(dry_run_receipts)
 
     return updates, database, post_cache
+
+
+# Retries the queued crossposts that are due, see local.jobs.
+def retry_jobs(database: Dict[str, Any], post_cache: Dict[str, Any]):
+    queue = get_job_queue()
+    updates = False
+    for job in queue.due():
+        breaker = get_breaker(job.destination)
+        if breaker.is_open():
+            # Waiting for a destination that is down doesn't use up the job's attempts
+            queue.retry_later(job, at=breaker.next_trial_at)
+            continue
+        write_log(f"Retrying post {job.cid} at {job.destination.name.lower()} (attempt {job.attempt + 1})")
+        entry = db_lookup(database, job.cid)
+        failed_before = entry.get_failed(job.destination) if entry else 0
+        changed, database, post_cache = post({job.cid: job.post}, database, post_cache, only=job.destination)
+        updates = updates or changed
+        entry = db_lookup(database, job.cid)
+        if entry is None or entry.get_id(job.destination):
+            queue.remove(job)
+        elif entry.get_failed(job.destination) >= settings.max_retries:
+            write_log(f"Giving up on post {job.cid} at {job.destination.name.lower()} "
+                      f"after {entry.get_failed(job.destination)} attempts", "error")
+            entry.set_id(job.destination, "FailedToPost")
+            database = db_update(database, job.cid, entry)
+            updates = True
+            queue.remove(job)
+        elif entry.get_failed(job.destination) == failed_before:
+            # Nothing was sent (hourly limit reached or the destination went down meanwhile)
+            queue.retry_later(job, at=max(breaker.next_trial_at, time.time() + backoff(job.attempt)))
+        else:
+            queue.retry_later(job)
+    return updates, database, post_cache
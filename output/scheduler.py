@@ -0,0 +1,74 @@
+from settings import settings
+from local.functions import write_log
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Posts in a batch are sent in dependency order: a reply or quote is only sent after the post it
+# replies to or quotes, if that post is in the same batch, so it can be threaded to the parent's new ids.
+# Posts that don't depend on each other (different threads) are sent at the same time.
+
+
+def build_dependencies(posts):
+    """Returns {cid: set of cids in the batch it waits for} and {cid: list of cids waiting for it}."""
+    parents = {}
+    children = {cid: [] for cid in posts}
+    for cid, post_obj in posts.items():
+        waits_for = {parent for parent in (post_obj.reply_to_id, post_obj.quoted_id)
+                     if parent and parent != cid and parent in posts}
+        parents[cid] = waits_for
+        for parent in waits_for:
+            children[parent].append(cid)
+    return parents, children
+
+
+def schedule_posts(posts, send, order, workers=None):
+    """Calls send(cid) for every post, each one once all of its parents in the batch are done.
+
+    order is the order posts are started in when several are ready (oldest first). If send returns
+    False no further posts are started, the ones already running are finished.
+    """
+    workers = workers or settings.post_workers
+    parents, children = build_dependencies(posts)
+    rank = {cid: i for i, cid in enumerate(order)}
+    pending = {cid: len(parents[cid]) for cid in order}
+    ready = [cid for cid in order if not pending[cid]]
+    done = set()
+    stopped = False
+
+    def release(cid):
+        done.add(cid)
+        for child in children[cid]:
+            pending[child] -= 1
+            if not pending[child]:
+                ready.append(child)
+        ready.sort(key=rank.get)
+
+    if workers <= 1:
+        while ready and not stopped:
+            cid = ready.pop(0)
+            stopped = send(cid) is False
+            release(cid)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="post") as pool:
+            running = {}
+            while (ready or running) and not stopped:
+                while ready and len(running) < workers and not stopped:
+                    cid = ready.pop(0)
+                    running[pool.submit(send, cid)] = cid
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    cid = running.pop(future)
+                    try:
+                        stopped = future.result() is False or stopped
+                    except Exception as error:
+                        write_log(error, "error")
+                    release(cid)
+            wait(running)
+
+    if not stopped:
+        # Only posts in a reply/quote cycle are left, which can't happen with real posts. Send them
+        # in order rather than dropping them.
+        for cid in order:
+            if cid not in done:
+                write_log(f"Post {cid} is part of a reply cycle in this batch, sending it in order", "error")
+                if send(cid) is False:
+                    break
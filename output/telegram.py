@@ -3,6 +3,9 @@ import requests
 import json
 from settings.auth import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID
 from local.functions import write_log
+from local.media_ids import remote_media_id, remember_media_id
+from local.upload import MultipartStream
+from models.entry import Destination
 
 def post_to_telegram(content, link, images=None, bluesky_link=None):
     """
@@ -27,40 +30,50 @@ def post_to_telegram(content, link, images=None, bluesky_link=None):
             # Convert file paths to open file handles
             
             # Simple list of paths logic:
+            paths = [img if isinstance(img, str) else img.get('filename') for img in images] # Handle dicts from get_images
+            # Photos sent before are sent by their file_id instead of uploading them again
+            file_ids = [remote_media_id(Destination.TELEGRAM, path) for path in paths]
             if len(images) == 1:
-                img_path = images[0]
-                if isinstance(img_path, dict): img_path = img_path.get('filename') # Handle dict from get_images
-                
-                with open(img_path, 'rb') as f:
+                if file_ids[0]:
                     response = requests.post(
                         f"{base_url}/sendPhoto",
-                        data={"chat_id": channel_id, "caption": text},
-                        files={"photo": f}
+                        data={"chat_id": channel_id, "caption": text, "photo": file_ids[0]}
                     )
+                else:
+                    body = MultipartStream({"chat_id": channel_id, "caption": text}, {"photo": paths[0]})
+                    try:
+                        response = requests.post(
+                            f"{base_url}/sendPhoto",
+                            data=body,
+                            headers={"Content-Type": body.content_type}
+                        )
+                    finally:
+                        body.close()
             else:
                 # Media Group for multiple images
                 media_group = []
                 files = {}
-                for i, img in enumerate(images):
-                    path = img if isinstance(img, str) else img.get('filename')
+                for i, path in enumerate(paths):
                     # We need to map file inputs. Key can be "photo0", "photo1"...
                     # Media item: {"type": "photo", "media": "attach://photo0"}
                     media_group.append({
                         "type": "photo",
-                        "media": f"attach://photo{i}",
+                        "media": file_ids[i] or f"attach://photo{i}",
                         "caption": text if i == 0 else "" # Caption only on first item
                     })
-                    files[f"photo{i}"] = open(path, 'rb')
-                
-                response = requests.post(
-                    f"{base_url}/sendMediaGroup",
-                    data={"chat_id": channel_id, "media": json.dumps(media_group)},
-                    files=files
-                )
+                    if not file_ids[i]:
+                        files[f"photo{i}"] = path
                 
-                # Close files
-                for f in files.values():
-                    f.close()
+                # The files are read from disk one after the other while the request is sent
+                body = MultipartStream({"chat_id": channel_id, "media": json.dumps(media_group)}, files)
+                try:
+                    response = requests.post(
+                        f"{base_url}/sendMediaGroup",
+                        data=body,
+                        headers={"Content-Type": body.content_type}
+                    )
+                finally:
+                    body.close()
                     
         else:
             # Text only
@@ -76,6 +89,8 @@ def post_to_telegram(content, link, images=None, bluesky_link=None):
                 # Telegram returns a message object. We can use message_id as ID.
                 # If group, it returns list of messages.
                 res_content = result.get("result")
+                if images:
+                    remember_file_ids(paths, res_content)
                 if isinstance(res_content, list):
                     return str(res_content[0].get("message_id"))
                 return str(res_content.get("message_id"))
@@ -89,3 +104,12 @@ def post_to_telegram(content, link, images=None, bluesky_link=None):
     except Exception as e:
         write_log(f"Telegram Exception: {e}", "error")
         return None
+
+
+def remember_file_ids(paths, sent):
+    """Stores the file_id Telegram gave each sent photo (the largest size of it)."""
+    messages = sent if isinstance(sent, list) else [sent]
+    for path, message in zip(paths, messages):
+        sizes = message.get("photo") or []
+        if sizes:
+            remember_media_id(Destination.TELEGRAM, path, sizes[-1]["file_id"])
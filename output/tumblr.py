@@ -1,8 +1,10 @@
 import pytumblr
 import re
+import requests
 from settings.auth import TUMBLR_CONSUMER_KEY, TUMBLR_CONSUMER_SECRET, TUMBLR_OAUTH_TOKEN, TUMBLR_OAUTH_SECRET, \
     TUMBLR_BLOG_NAME
 from local.functions import write_log
+from local.upload import MultipartStream
 
 # Initialize the Tumblr client
 tumblr_client = pytumblr.TumblrRestClient(
@@ -19,6 +21,29 @@ def extract_hashtags(text):
     return [tag.strip('#') for tag in hashtags]  # Remove the '#' for Tumblr tags
 
 
+def create_media_post(post_type, caption, hashtags, files):
+    """Creates a photo or video post like tumblr_client.create_photo/create_video, but streams the
+    files from disk instead of reading them into memory. files is {form field: path}."""
+    params = {"type": post_type, "state": "published", "caption": caption}  # Use the post text as the caption
+    if hashtags:
+        params["tags"] = ",".join(hashtags)  # Add the extracted hashtags as tags
+    request = tumblr_client.request
+    body = MultipartStream(params, files)
+    try:
+        # As in pytumblr, the parameters are also sent in the query string, which is what OAuth signs
+        response = requests.post(
+            f"{request.host}/v2/blog/{TUMBLR_BLOG_NAME}/post",
+            params=params,
+            data=body,
+            headers=dict(request.headers, **{"Content-Type": body.content_type}),
+            allow_redirects=False,
+            auth=request.oauth,
+        )
+    finally:
+        body.close()
+    return request.json_parse(response)
+
+
 def post_to_tumblr(post, media=None):
     try:
         hashtags = extract_hashtags(post)  # Extract hashtags from the post text
@@ -36,22 +61,11 @@ def post_to_tumblr(post, media=None):
 
             # Post as a video if there's an .mp4 file
             if video:
-                response = tumblr_client.create_video(
-                    TUMBLR_BLOG_NAME,
-                    state="published",
-                    caption=post,  # Use the post text as the caption
-                    data=video,  # Video file
-                    tags=hashtags  # Add the extracted hashtags as tags
-                )
+                response = create_media_post("video", post, hashtags, {"data": video})
             # Post as a photo if there are images
             elif photoset:
-                response = tumblr_client.create_photo(
-                    TUMBLR_BLOG_NAME,
-                    state="published",
-                    caption=post,  # Use the post text as the caption
-                    data=photoset,  # List of image files
-                    tags=hashtags  # Add the extracted hashtags as tags
-                )
+                response = create_media_post("photo", post, hashtags,
+                                             {f"data[{i}]": path for i, path in enumerate(photoset)})
 
             if 'id' in response:
                 write_log("Posted to Tumblr successfully")
@@ -2,6 +2,8 @@ import tweepy
 from settings import settings 
 from settings.auth import *
 from local.functions import write_log
+from local.media_ids import remote_media_id, remember_media_id
+from models.entry import Destination
 
 if settings.Twitter:
     twitter_client = tweepy.Client(
@@ -26,12 +28,19 @@ def tweet(post, reply_to_post, quoted_post, images, allowed_reply):
             alt = image["alt"]
             if len(alt) > 1000:
                 alt = alt[:996] + "..."
+            # Media uploaded within the last day (e.g. before a failed attempt) is not uploaded again
+            id = remote_media_id(Destination.TWITTER, filename, alt)
+            if id:
+                write_log("Reusing image " + filename + " already uploaded to twitter")
+                media_ids.append(id)
+                continue
             res = twitter_api.media_upload(filename)
             id = res.media_id
             # If alt text was added to the image on bluesky, it's also added to the image on twitter.
             if alt:
                 write_log("Uploading image " + filename + " with alt: " + alt + " to twitter")
                 twitter_api.create_media_metadata(id, alt)
+            remember_media_id(Destination.TWITTER, filename, id, alt)
             media_ids.append(id)
     # Checking if the post is longer than 280 characters, and if so sending to the
     # splitPost-function.
@@ -6,6 +6,26 @@ base_path = "./"
 # Path to the database file. If you want it somewhere other than directly in the base path you can 
 # either write the entire path manually, or just add the rest of the path on top of the basePath.
 database_path = base_path + "db/database.json"
+# Path to the SQLite database used by the default storage backend. On first start an existing
+# database at database_path is imported into it.
+sqlite_path = base_path + "db/database.sqlite"
+# Path to the archive of old database entries when using the jsonl backend (the sqlite backend keeps
+# them in a separate table). See db_retention_days in settings.
+archive_path = base_path + "db/archive.json"
+# Path to the queue of crossposts waiting to be retried, and to the folder where media of queued posts
+# that can't be downloaded again is kept.
+queue_path = base_path + "db/queue.sqlite"
+queue_media_path = base_path + "db/queue_media/"
+# Path to the cache of ids that media got when it was uploaded to each destination
+media_ids_path = base_path + "db/media_ids.json"
+# Path to the cache of Bluesky handles mentioned in posts and the accounts they belong to
+handles_path = base_path + "db/handles.json"
+# Path to the cache of authors of Bluesky posts that were replied to
+post_authors_path = base_path + "db/post_authors.json"
+# Path to the file keeping track of the newest Bluesky post that was already handled
+feed_state_path = base_path + "db/bsky_feed.json"
+# Path to the file keeping the cursor of the Bluesky event stream (see bsky_stream in settings)
+stream_state_path = base_path + "db/jetstream.json"
 # Path to the cache-file, which keeps track of recent posts, allowing you to limit posts per hours and
 # retweet yourself 
 post_cache_path = base_path + "db/post.cache"
@@ -74,6 +74,90 @@ max_per_hour = 0
 # If set to "skip" the posts will be skipped and the poster will instead continue on with new posts.
 # Accepted values: retry, skip
 overflow_posts = "retry"
+# A crosspost that fails is retried from a queue, independently of the post still being fetched. The
+# first retry waits about queue_backoff_base seconds, every following one twice as long as the one
+# before, up to queue_backoff_max seconds. After max_retries failed attempts the post is given up on.
+# Accepted values: Integers greater than 0
+queue_backoff_base = 60
+queue_backoff_max = 3600
+# After breaker_threshold failed crossposts in a row a destination is considered down, and is skipped
+# for breaker_cooldown seconds instead of making every post wait for it to time out. Posts skipped this
+# way don't use up their max_retries.
+# Accepted values: Integers greater than 0
+breaker_threshold = 3
+breaker_cooldown = 300
+# Downloaded images and videos are kept for later runs (retries, reposts) until the images folder grows
+# past media_cache_size megabytes, then the least recently used ones are deleted. 0 deletes all of them
+# after every run.
+# Accepted values: Integers, 0 or greater
+media_cache_size = 500
+# Media of a post is downloaded download_workers files at a time. A download is given up on after
+# download_timeout seconds, or if the file is larger than max_file_download megabytes or takes all media
+# of the post over max_post_download megabytes.
+# Accepted values: Integers greater than 0
+download_workers = 4
+download_timeout = 60
+max_file_download = 100
+max_post_download = 300
+# mastodon_media_timeout sets how many seconds Mastodon gets to process all media of a post after it
+# was uploaded, before the post is counted as failed.
+# Accepted values: Integers greater than 0
+mastodon_media_timeout = 120
+# Bluesky videos are converted to mp4 by up to video_workers ffmpeg processes at once, in the background
+# while posts are fetched. A conversion taking longer than video_timeout seconds is stopped.
+# Accepted values: Integers greater than 0
+video_workers = 2
+video_timeout = 300
+# Images that are too large (or in a format a destination doesn't take) are scaled down and re-encoded
+# for that destination by up to media_prep_workers processes at once. With strip_metadata on, every image
+# with EXIF data (like the location it was taken at) is re-encoded without it. Needs the Pillow package.
+# Accepted values: Integers greater than 0; True, False
+media_prep_workers = 2
+strip_metadata = False
+# Handles mentioned in posts sent to Bluesky are resolved to accounts once and remembered for
+# handle_cache_ttl hours. Handles that don't belong to any account are remembered for
+# handle_negative_ttl minutes. The authors of posts that are replied to (or that they were deleted)
+# are remembered for handle_cache_ttl hours as well.
+# Accepted values: Integers greater than 0
+handle_cache_ttl = 24
+handle_negative_ttl = 60
+# With bsky_stream on, new Bluesky posts are crossposted as soon as they are made, through a Jetstream
+# subscription to jetstream_url, instead of waiting for the next run to poll for them. Runs still poll
+# whenever the stream isn't connected, and every bsky_stream_poll minutes while it is, to pick up posts
+# the stream missed (0 polls on every run). Needs the websockets package.
+# Accepted values: True, False / Integers 0 or greater
+bsky_stream = False
+jetstream_url = "wss://jetstream2.us-east.bsky.network/subscribe"
+bsky_stream_poll = 30
+# destination_workers sets how many destinations a post is sent to at the same time. 1 sends to one
+# destination after the other.
+# Accepted values: Integers greater than 0
+destination_workers = 5
+# post_workers sets how many posts are crossposted at the same time. Replies and quotes still wait for
+# the post they reply to or quote. 1 sends one post after the other.
+# Accepted values: Integers greater than 0
+post_workers = 4
+# db_backend selects how the database of crossposted posts is stored. "sqlite" keeps it in an SQLite
+# database (see sqlite_path) and only writes rows that changed, "jsonl" keeps the legacy line-based
+# json file (see database_path).
+# Accepted values: sqlite, jsonl
+db_backend = "sqlite"
+# db_lazy_load keeps the database on disk instead of loading all of it at startup. Entries are only
+# read when a post (or the post it replies to or quotes) is looked up. With the jsonl backend the file
+# is memory-mapped and found through an index stored next to it (database_path + ".idx").
+# Accepted values: True, False
+db_lazy_load = False
+# db_retention_days moves database entries older than this many days into an archive, so the database
+# that is loaded on every run only holds recent posts. Replies and quotes of archived posts are still
+# found in the archive. 0 keeps every entry in the main database.
+# Accepted values: Integers, 0 or greater
+db_retention_days = 0
+# Once a day the database is backed up to the backup folder. backup_full_days sets how many days apart
+# full backups are taken, the backups in between only hold the entries that changed. backup_keep sets
+# how many full backups (with the changes taken after them) are kept.
+# Accepted values: Integers greater than 0
+backup_full_days = 7
+backup_keep = 4
 
 
 
@@ -105,6 +189,38 @@ max_per_hour = _env_int('MAX_PER_HOUR', max_per_hour)
 # Support both new and legacy env var names
 overflow_posts = (os.environ.get('OVERFLOW_POSTS') or os.environ.get('OVERFLOW_POST') or overflow_posts)
 
+queue_backoff_base = _env_int('QUEUE_BACKOFF_BASE', queue_backoff_base)
+queue_backoff_max = _env_int('QUEUE_BACKOFF_MAX', queue_backoff_max)
+breaker_threshold = _env_int('BREAKER_THRESHOLD', breaker_threshold)
+breaker_cooldown = _env_int('BREAKER_COOLDOWN', breaker_cooldown)
+media_cache_size = _env_int('MEDIA_CACHE_SIZE', media_cache_size)
+download_workers = _env_int('DOWNLOAD_WORKERS', download_workers)
+download_timeout = _env_int('DOWNLOAD_TIMEOUT', download_timeout)
+max_file_download = _env_int('MAX_FILE_DOWNLOAD', max_file_download)
+max_post_download = _env_int('MAX_POST_DOWNLOAD', max_post_download)
+mastodon_media_timeout = _env_int('MASTODON_MEDIA_TIMEOUT', mastodon_media_timeout)
+video_workers = _env_int('VIDEO_WORKERS', video_workers)
+video_timeout = _env_int('VIDEO_TIMEOUT', video_timeout)
+media_prep_workers = _env_int('MEDIA_PREP_WORKERS', media_prep_workers)
+strip_metadata = _env_bool('STRIP_METADATA', strip_metadata)
+handle_cache_ttl = _env_int('HANDLE_CACHE_TTL', handle_cache_ttl)
+handle_negative_ttl = _env_int('HANDLE_NEGATIVE_TTL', handle_negative_ttl)
+bsky_stream = _env_bool('BSKY_STREAM', bsky_stream)
+jetstream_url = os.environ.get('JETSTREAM_URL', jetstream_url) or jetstream_url
+bsky_stream_poll = _env_int('BSKY_STREAM_POLL', bsky_stream_poll)
+destination_workers = _env_int('DESTINATION_WORKERS', destination_workers)
+post_workers = _env_int('POST_WORKERS', post_workers)
+
+db_backend_env = os.environ.get('DB_BACKEND')
+if db_backend_env:
+	db_backend_env = db_backend_env.strip().lower()
+	if db_backend_env in {"sqlite", "jsonl"}:
+		db_backend = db_backend_env
+db_lazy_load = _env_bool('DB_LAZY_LOAD', db_lazy_load)
+db_retention_days = _env_int('DB_RETENTION_DAYS', db_retention_days)
+backup_full_days = _env_int('BACKUP_FULL_DAYS', backup_full_days)
+backup_keep = _env_int('BACKUP_KEEP', backup_keep)
+
 # Dry Run / Test Mode
 TEST_MODE = False
 TEST_MODE = _env_bool("TEST_MODE", False)
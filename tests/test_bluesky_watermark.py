@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import arrow
+
+from settings import settings
+from input import bluesky
+
+
+def feed_view(cid, indexed_at, author="someone.else.bsky.social"):
+    """A feed item get_posts skips, as it is by someone else. Without an author processing it fails."""
+    post = SimpleNamespace(cid=cid, indexed_at=indexed_at.isoformat(), record=SimpleNamespace(reply=None))
+    if author:
+        post.author = SimpleNamespace(handle=author)
+    return SimpleNamespace(post=post, reason=None)
+
+
+def page(items, cursor=None):
+    return SimpleNamespace(feed=items, cursor=cursor)
+
+
+class FeedClient:
+    """Returns the given pages of the author feed one after another. A page that is an exception is raised."""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.app = SimpleNamespace(bsky=SimpleNamespace(feed=SimpleNamespace(get_author_feed=self.get_author_feed)))
+
+    def get_author_feed(self, params):
+        result = self.pages.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class WatermarkTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [
+            mock.patch.object(settings, "TEST_MODE", False),
+            mock.patch.object(settings, "log_level", "none"),
+            mock.patch.object(bluesky, "feed_state_path", os.path.join(directory.name, "bsky_feed.json")),
+            mock.patch.object(bluesky, "BSKY_HANDLE", "me.bsky.social"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        now = arrow.utcnow()
+        self.timelimit = now.shift(hours=-1)
+        # Newest first, split over two pages
+        self.views = [feed_view(f"cid{i}", now.shift(minutes=-i)) for i in range(4)]
+
+    def fetch(self, pages):
+        with mock.patch.object(bluesky, "get_bsky_session", return_value=FeedClient(pages)):
+            posts = bluesky.get_posts(self.timelimit)
+        bluesky.commit_watermark({})
+        return posts
+
+    def test_watermark_moves_to_newest_handled_post(self):
+        self.fetch([page(self.views[:2], "next"), page(self.views[2:])])
+        self.assertEqual(bluesky.read_watermark()[1], "cid0")
+
+    def test_failed_page_keeps_watermark(self):
+        self.fetch([page(self.views[:2], "next"), page(self.views[2:])])
+        watermark = bluesky.read_watermark()
+        newer = [feed_view(f"new{i}", arrow.utcnow().shift(seconds=i)) for i in range(4)][::-1]
+
+        posts = self.fetch([page(newer[:2], "next"), RuntimeError("page 2 failed")])
+
+        self.assertEqual(posts, {})
+        self.assertEqual(bluesky.read_watermark(), watermark)
+
+    def test_failed_post_holds_watermark_before_it(self):
+        self.views[2] = feed_view("cid2", arrow.get(self.views[2].post.indexed_at), author=None)
+
+        self.fetch([page(self.views[:2], "next"), page(self.views[2:])])
+
+        self.assertEqual(bluesky.read_watermark()[1], "cid3")
+
+
+if __name__ == "__main__":
+    unittest.main()
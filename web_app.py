@@ -7,8 +7,12 @@ import time
 from database import DatabaseManager
 from core import Crossposter
 from settings import settings
-from settings.paths import log_path, image_path
+from settings.paths import image_path
 from settings_manager import SettingsManager
+from local.jobs import get_job_queue
+from local.breaker import breaker_states
+from input.jetstream import get_stream
+from local.logger import read_logs, format_record
 
 
 class PrefixMiddleware(object):
@@ -46,6 +50,8 @@ crossposter = Crossposter(db_manager, settings_manager)
 
 # Scheduler Globals
 scheduler_thread = None
+job_worker_thread = None
+stream_thread = None
 stop_event = threading.Event()
 
 def run_scheduler():
@@ -74,6 +80,26 @@ def run_scheduler():
             print(f"Scheduler Error: {e}")
             time.sleep(60) # Backoff on error
 
+def run_job_worker():
+    """Background loop retrying queued crossposts as soon as they are due, independent of RUN_INTERVAL."""
+    queue = get_job_queue()
+    while not stop_event.is_set():
+        try:
+            next_due = queue.next_due()
+            # Wake up at least once a minute to pick up jobs queued meanwhile
+            wait = 60 if next_due is None else min(max(next_due - time.time(), 1), 60)
+            if stop_event.wait(wait):
+                break
+            if next_due is not None and next_due <= time.time():
+                crossposter.retry_jobs()
+        except Exception as e:
+            print(f"Job Worker Error: {e}")
+            time.sleep(60)
+
+def run_stream():
+    """Crossposts new Bluesky posts as they come in through the event stream, if bsky_stream is on."""
+    get_stream().run(crossposter.process_stream, stop_event)
+
 @app.route('/')
 def home():
     auto_run = settings_manager.get_bool("AUTO_RUN", False)
@@ -165,6 +191,11 @@ def get_dry_run_results():
             return jsonify(json.load(f))
     return jsonify([])
 
+@app.route('/api/breakers')
+def get_breakers():
+    """State of the circuit breaker of every destination, and how many retries are queued."""
+    return jsonify({'breakers': breaker_states(), 'queued': get_job_queue().count()})
+
 @app.route('/logs')
 def logs_page():
     return render_template('logs.html')
@@ -190,59 +221,41 @@ def run_job():
 
 @app.route('/api/logs')
 def get_logs():
-    # Get configured timezone
-    tz = settings_manager.get("TIMEZONE", "US/Pacific")
-    
-    date = arrow.now(tz).format("YYMMDD")
-    current_log = log_path + date + ".log"
-    
-    if os.path.exists(current_log):
-        # Parse query params
-        limit = request.args.get('limit', 100, type=int)
-        hours = request.args.get('hours', 0, type=int)
+    # Parse query params
+    limit = request.args.get('limit', 100, type=int)
+    hours = request.args.get('hours', 0, type=int)
+    # Cursor returned by the previous call, to get only what was logged since
+    after = request.args.get('after')
 
+    since = None
+    if not after:
         # Get configured timezone
         tz = settings_manager.get("TIMEZONE", "US/Pacific")
-        
-        with open(current_log, 'r') as f:
-            content = f.read()
-            lines = content.splitlines()
-            
-            if hours > 0:
-                # Calculate cutoff in the configured timezone
-                cutoff = arrow.now(tz).shift(hours=-hours)
-                filtered = []
-                for line in lines:
-                    try:
-                        # Extract timestamp: "12/12/2025 01:38:21 (MESSAGE)..."
-                        parts = line.split('(', 1)
-                        if len(parts) > 1:
-                            ts_str = parts[0].strip()
-                            # Parse with explicit timezone
-                            # Note: The log itself writes MM/DD/YYYY, let's trust it maps correctly to the TZ 
-                            # used to write it.
-                            ts = arrow.get(ts_str, "MM/DD/YYYY HH:mm:ss", tzinfo=tz)
-                            
-                            if ts >= cutoff:
-                                filtered.append(line)
-                        else:
-                            if filtered: filtered.append(line)
-                    except:
-                        if filtered: filtered.append(line)
-                lines = filtered
-
-            if limit > 0:
-                lines = lines[-limit:]
-                
-            return jsonify({'logs': '\n'.join(lines)})
-    
-    return jsonify({'logs': 'No logs for today.'})
+        if hours > 0:
+            since = arrow.now(tz).shift(hours=-hours).timestamp()
+        else:
+            since = arrow.now(tz).floor('day').timestamp()
+
+    try:
+        records, cursor = read_logs(since=since, limit=max(limit, 0), after=after)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    if not records and not after:
+        return jsonify({'logs': 'No logs for today.', 'cursor': cursor})
+    return jsonify({'logs': '\n'.join(format_record(record) for record in records), 'cursor': cursor})
 
 def start_scheduler():
-    global scheduler_thread
+    global scheduler_thread, job_worker_thread, stream_thread
     if not scheduler_thread or not scheduler_thread.is_alive():
         scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
         scheduler_thread.start()
+    if not job_worker_thread or not job_worker_thread.is_alive():
+        job_worker_thread = threading.Thread(target=run_job_worker, daemon=True)
+        job_worker_thread.start()
+    if settings.bsky_stream and (not stream_thread or not stream_thread.is_alive()):
+        stream_thread = threading.Thread(target=run_stream, daemon=True)
+        stream_thread.start()
 
 if __name__ == '__main__':
     # Only run the scheduler in the reloader process (or if reloader is off)